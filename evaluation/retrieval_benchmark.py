@@ -0,0 +1,193 @@
+"""
+Retrieval benchmark of the SME collections: recall@k (share of the relevant pages retrieved), hit rate@k
+(share of the questions with at least one relevant page retrieved), MRR, p50/p95 latency and prompt tokens
+per query on a labelled question -> relevant pages dataset.
+
+    python evaluation/retrieval_benchmark.py --output results.json
+    python evaluation/retrieval_benchmark.py --baseline results.json --options '{"diverse": true}'
+
+With --baseline the run exits with status 1 when a collection regresses beyond the allowed margins,
+so it can gate a change of CHUNK_SIZE, CHUNK_OVERLAP, k or retriever options.
+--offline refuses to call the embedding API: the query vectors must be in the query embedding cache
+(filled by a previous run) or the collection must use the local onnx backend, any cache miss fails the run.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+load_dotenv(find_dotenv())
+
+from embedding import chroma
+from embedding.chroma import ChromaSme
+from embedding.diversity import estimate_tokens
+from embedding.embeddings_creator import ONNX_BACKEND
+from embedding.sme.kubepython_sme import KubePythonSme, KUBEPYTHON_CHROMA_INDEX
+from embedding.sme.kubernetes_sme import KubernetesSme, KUBERNTES_CHROMA_INDEX
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_dataset.json")
+SMES = {KUBERNTES_CHROMA_INDEX: KubernetesSme, KUBEPYTHON_CHROMA_INDEX: KubePythonSme}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency of the SME collections")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Labelled dataset {collection: [{question, relevant}]}")
+    parser.add_argument("--collections", nargs="*", help="Collections to benchmark (default: all the ones in the dataset)")
+    parser.add_argument("--k", type=int, default=5, help="Documents retrieved per question (default: 5)")
+    parser.add_argument("--options", default="{}", help="JSON options passed to getRetriever (e.g. '{\"diverse\": true}')")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per question, the median is used (default: 3)")
+    parser.add_argument("--offline", action="store_true", help="Fail instead of calling the embedding API")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results of a previous run and exit 1 on regression")
+    parser.add_argument("--max-recall-drop", type=float, default=0.02, help="Allowed recall@k, hit rate@k and MRR drop (default: 0.02)")
+    parser.add_argument("--max-latency-increase", type=float, default=0.25, help="Allowed relative p95 increase (default: 0.25)")
+    parser.add_argument("--max-tokens-increase", type=float, default=0.10, help="Allowed relative prompt tokens increase (default: 0.10)")
+    return parser.parse_args()
+
+
+def document_sources(document) -> list:
+    # a deduplicated chunk lists every page it comes from in "sources" (space separated), "source" is only the first
+    return [document.metadata.get("source", "")] + (document.metadata.get("sources") or "").split()
+
+
+def from_page(document, page: str) -> bool:
+    return any(page in source for source in document_sources(document))
+
+
+def is_relevant(document, relevant: list) -> bool:
+    return any(from_page(document, item) for item in relevant)
+
+
+class OfflineEmbeddings(Embeddings):
+    """Replaces the embedding model behind the query cache with --offline, a cache miss raises instead of calling the API."""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self.missing = []
+
+    def __miss(self, text: str):
+        self.missing.append(text)
+        raise RuntimeError(f"[{self.collection}] offline run, not in the query embedding cache: {text}")
+
+    def embed_documents(self, texts: list) -> list:
+        self.__miss(texts[0] if texts else "")
+
+    def embed_query(self, text: str) -> list:
+        self.__miss(text)
+
+
+def check_offline(sme: ChromaSme, questions: list) -> OfflineEmbeddings:
+    if sme.embedding_backend == ONNX_BACKEND:
+        return None
+    embeddings = sme.embeddings
+    missing = [question for question in questions if embeddings.cache.get(embeddings.cache.key(question, embeddings.model_key)) is None]
+    if missing:
+        sys.exit(f"[{sme.collection_name}] {len(missing)} questions are not in the query embedding cache, run once online first: {missing[:3]}")
+    # the retriever falls back to lexical results when the embedding fails, the misses are checked after every query
+    embeddings.embeddings = OfflineEmbeddings(sme.collection_name)
+    return embeddings.embeddings
+
+
+def benchmark(sme: ChromaSme, items: list, k: int, options: dict, repeat: int, offline: OfflineEmbeddings = None) -> dict:
+    # cache=False: a retrieval result cache hit would measure nothing
+    retriever = sme.getRetriever(**{"k": k, **options, "cache": False})
+    retriever.invoke(items[0]["question"])
+
+    recalls, hit_rates, reciprocal_ranks, latencies, tokens, misses = [], [], [], [], [], []
+    for item in items:
+        timings = []
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            documents = retriever.invoke(item["question"])
+            timings.append(time.perf_counter() - start)
+            if offline is not None and offline.missing:
+                sys.exit(f"[{sme.collection_name}] offline run called the embedding API for: {offline.missing[0]}")
+        latencies.append(float(np.median(timings)))
+
+        hits = [is_relevant(document, item["relevant"]) for document in documents[:k]]
+        relevant = set(item["relevant"])
+        found = {page for page in relevant for document in documents[:k] if from_page(document, page)}
+        recalls.append(len(found) / len(relevant) if relevant else 0.0)
+        hit_rates.append(1.0 if found else 0.0)
+        reciprocal_ranks.append(1 / (hits.index(True) + 1) if True in hits else 0.0)
+        tokens.append(sum(estimate_tokens(document.page_content) for document in documents))
+        if not found:
+            misses.append(item["question"])
+
+    return {
+        "questions":      len(items),
+        "recall_at_k":    float(np.mean(recalls)),
+        "hit_rate_at_k":  float(np.mean(hit_rates)),
+        "mrr":            float(np.mean(reciprocal_ranks)),
+        "p50_ms":         float(np.percentile(latencies, 50) * 1000),
+        "p95_ms":         float(np.percentile(latencies, 95) * 1000),
+        "prompt_tokens":  float(np.mean(tokens)),
+        "misses":         misses,
+        # what the numbers depend on, to tell apart two index builds
+        "build": {
+            "version":           sme.getVersion(),
+            "chunks":            sme.getDb()._collection.count(),
+            "chunk_size":        chroma.CHUNK_SIZE,
+            "chunk_overlap":     chroma.CHUNK_OVERLAP,
+            "embedding_backend": sme.embedding_backend,
+        },
+    }
+
+
+def compare(results: dict, baseline: dict, args: argparse.Namespace) -> list:
+    regressions = []
+    if (baseline.get("k"), baseline.get("options")) != (results["k"], results["options"]):
+        print(f"Baseline ran with k={baseline.get('k')} options={baseline.get('options')}, the comparison is not like for like")
+    for collection, current in results["collections"].items():
+        previous = baseline.get("collections", {}).get(collection)
+        if previous is None:
+            continue
+        metrics = {"recall_at_k": "recall_at_k", "hit_rate_at_k": "hit_rate_at_k", "mrr": "mrr"}
+        if "hit_rate_at_k" not in previous:
+            # older results stored the hit rate as recall_at_k
+            print(f"{collection}: baseline has no hit_rate_at_k, its recall_at_k is compared as hit rate")
+            metrics = {"hit_rate_at_k": "recall_at_k", "mrr": "mrr"}
+        for metric, previous_metric in metrics.items():
+            if current[metric] < previous[previous_metric] - args.max_recall_drop:
+                regressions.append(f"{collection}: {metric} {previous[previous_metric]:.3f} -> {current[metric]:.3f}")
+        if current["p95_ms"] > previous["p95_ms"] * (1 + args.max_latency_increase):
+            regressions.append(f"{collection}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current["prompt_tokens"] > previous["prompt_tokens"] * (1 + args.max_tokens_increase):
+            regressions.append(f"{collection}: prompt tokens {previous['prompt_tokens']:.0f} -> {current['prompt_tokens']:.0f}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    options = json.loads(args.options)
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+
+    results = {"k": args.k, "options": options, "collections": {}}
+    for collection in args.collections or list(dataset):
+        sme = SMES[collection]() if collection in SMES else ChromaSme(collection)
+        offline = check_offline(sme, [item["question"] for item in dataset[collection]]) if args.offline else None
+        result = results["collections"][collection] = benchmark(sme, dataset[collection], args.k, options, args.repeat, offline)
+        print(f"{collection}: recall@{args.k} {result['recall_at_k']:.3f}  hit rate@{args.k} {result['hit_rate_at_k']:.3f}  MRR {result['mrr']:.3f}  "
+              f"p50 {result['p50_ms']:.1f}ms  p95 {result['p95_ms']:.1f}ms  tokens/query {result['prompt_tokens']:.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
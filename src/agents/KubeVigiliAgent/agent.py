@@ -5,7 +5,9 @@ from langchain.agents import AgentExecutor
 from injectable import injectable
 from langchain.memory import ConversationBufferWindowMemory
 
-from tools.kubernetes_sme.tool import KubernetesSmeTool
+from tools.federated_sme.tool import FederatedSmeTool
+from tools.queryEvents_tool.tool import QueryEventsTool
+from tools.podLogs_tool.tool import PodLogsTool
 from langchain.schema.runnable import RunnableConfig
 
 from typing import Optional, Any, Literal, Sequence
@@ -17,7 +19,9 @@ class KubeVigilAgent():
     def __init__(self) -> None:
         try:
             tools = [
-                KubernetesSmeTool().getTool()
+                FederatedSmeTool().getTool(),
+                QueryEventsTool().getTool(),
+                PodLogsTool().getTool()
             ]
 
             self.agent = create_openai_tools_agent(
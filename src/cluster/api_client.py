@@ -0,0 +1,97 @@
+import json
+import os
+import requests
+
+SERVICE_ACCOUNT_PATH = "/var/run/secrets/kubernetes.io/serviceaccount"
+DEFAULT_TIMEOUT = 30
+STREAM_CHUNK_SIZE = 8192
+
+
+class KubeApiClient:
+    """
+    Minimal REST client for the Kubernetes API server.
+
+    Inside the cluster it uses the service account mounted in the pod,
+    otherwise KUBE_API_SERVER / KUBE_API_TOKEN can point it anywhere
+    (a `kubectl proxy` or a local fake API server used in tests).
+    """
+
+    def __init__(self, base_url: str = None, token: str = None, verify=None):
+        self.base_url = (base_url or self.__defaultBaseUrl()).rstrip("/")
+
+        self.session = requests.Session()
+        token = token or os.getenv('KUBE_API_TOKEN') or self.__readServiceAccount("token")
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        if verify is None:
+            ca_path = os.path.join(SERVICE_ACCOUNT_PATH, "ca.crt")
+            verify = os.getenv('KUBE_API_CA', ca_path if os.path.exists(ca_path) else True)
+        self.session.verify = verify
+
+# ================================================
+    def __defaultBaseUrl(self) -> str:
+        if os.getenv('KUBE_API_SERVER'):
+            return os.getenv('KUBE_API_SERVER')
+        host = os.getenv('KUBERNETES_SERVICE_HOST', "127.0.0.1")
+        port = os.getenv('KUBERNETES_SERVICE_PORT', "443")
+        return f"https://{host}:{port}"
+
+    def __readServiceAccount(self, name: str):
+        try:
+            with open(os.path.join(SERVICE_ACCOUNT_PATH, name), 'r') as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return None
+
+# ================================================
+    def get(self, path: str, params: dict = None, timeout: float = DEFAULT_TIMEOUT) -> dict:
+        response = self.session.get(f"{self.base_url}{path}", params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+# ================================================
+    def stream(self, path: str, params: dict = None, timeout: float = None, max_line_bytes: int = None):
+        """
+        Opens a streaming GET and yields the response lines as they arrive.
+        With max_line_bytes longer lines are truncated, so memory stays bounded whatever the body size.
+        The caller must close the generator (or exhaust it) to release the connection.
+        """
+        response = self.session.get(f"{self.base_url}{path}", params=params, stream=True, timeout=timeout)
+        try:
+            response.raise_for_status()
+            pending = bytearray()
+            # the current line was already yielded truncated, the rest of it is dropped
+            skipping = False
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                parts = chunk.split(b"\n")
+                for index, part in enumerate(parts):
+                    if not skipping:
+                        pending.extend(part)
+                        if max_line_bytes and len(pending) > max_line_bytes:
+                            yield pending[:max_line_bytes].decode("utf-8", errors="replace")
+                            pending = bytearray()
+                            skipping = True
+                    if index < len(parts) - 1:
+                        # a newline ends the line
+                        if not skipping and pending.strip():
+                            yield pending.decode("utf-8", errors="replace")
+                        pending = bytearray()
+                        skipping = False
+
+            if pending.strip() and not skipping:
+                yield pending.decode("utf-8", errors="replace")
+        finally:
+            response.close()
+
+# ================================================
+    def watch(self, path: str, resource_version: str, timeout_seconds: int = 300):
+        params = {
+            "watch": "1",
+            "resourceVersion": resource_version,
+            "allowWatchBookmarks": "true",
+            "timeoutSeconds": str(timeout_seconds),
+        }
+        # read timeout slightly above the server side one, so a dead connection is noticed
+        for line in self.stream(path, params=params, timeout=(DEFAULT_TIMEOUT, timeout_seconds + 30)):
+            yield json.loads(line)
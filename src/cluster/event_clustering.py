@@ -0,0 +1,135 @@
+import hashlib
+import re
+from collections import defaultdict
+
+from utils.utils import mask_volatile_tokens
+
+NUM_PERMUTATIONS = 32
+BANDS = 8
+SIMILARITY_THRESHOLD = 0.7
+MAX_EXAMPLE_OBJECTS = 5
+
+MERSENNE_PRIME = (1 << 61) - 1
+PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % MERSENNE_PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+TOKEN = re.compile(r'<[A-Z]+>|\w+')
+
+
+def event_template(event: dict) -> str:
+    return mask_volatile_tokens(f"{event.get('type')} {event.get('reason')} {event.get('kind')} "
+                                f"{event.get('name')} {event.get('message', '')}")
+
+
+def minhash(text: str) -> list:
+    tokens = TOKEN.findall(text.lower())
+    # word bigrams keep some ordering information, single tokens handle very short messages
+    shingles = set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big") for shingle in shingles] or [0]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def similarity(signature: list, other: list) -> float:
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERMUTATIONS
+
+
+class EventCluster:
+
+    def __init__(self, template: str, signature: list, event: dict):
+        self.template = template
+        self.signature = signature
+        self.representative = event
+        self.count = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.namespaces = set()
+        self.objects = []
+
+    def add(self, event: dict):
+        if self.representative is None:
+            self.representative = event
+        self.count += event.get("count") or 1
+        timestamp = event.get("timestamp")
+        if timestamp is not None:
+            self.first_seen = timestamp if self.first_seen is None else min(self.first_seen, timestamp)
+            if self.last_seen is None or timestamp >= self.last_seen:
+                self.last_seen = timestamp
+                # the most recent occurrence is the most useful example
+                self.representative = event
+        self.namespaces.add(event.get("namespace"))
+        involved = f"{event.get('kind')}/{event.get('name')}"
+        if involved not in self.objects and len(self.objects) < MAX_EXAMPLE_OBJECTS:
+            self.objects.append(involved)
+
+
+class EventClusterer:
+    """
+    Groups near-identical events before they reach the prompt.
+
+    Events are first reduced to a template by masking the volatile tokens (pod hashes, numbers,
+    timestamps, ips...): identical templates fall in the same cluster with a dictionary lookup.
+    New templates are compared through MinHash LSH to the existing clusters and merged when
+    similar enough, which catches messages differing by a few words.
+
+    Events are plain dicts with the keys: type, reason, kind, name, namespace, message,
+    timestamp (any comparable value) and count.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.by_template = {}
+        self.buckets = defaultdict(list)
+        self.clusters = []
+
+    def add(self, event: dict) -> EventCluster:
+        template = event_template(event)
+        cluster = self.by_template.get(template)
+        if cluster is None:
+            cluster = self.__find_similar(template)
+            self.by_template[template] = cluster
+        cluster.add(event)
+        return cluster
+
+    def add_all(self, events) -> "EventClusterer":
+        for event in events:
+            self.add(event)
+        return self
+
+    def __find_similar(self, template: str) -> EventCluster:
+        signature = minhash(template)
+        rows = NUM_PERMUTATIONS // BANDS
+        bands = [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(BANDS)]
+
+        best, best_score = None, self.threshold
+        for band in bands:
+            for candidate in self.buckets.get(band, ()):
+                score = similarity(signature, candidate.signature)
+                if score >= best_score:
+                    best, best_score = candidate, score
+        if best is not None:
+            return best
+
+        cluster = EventCluster(template, signature, None)
+        self.clusters.append(cluster)
+        for band in bands:
+            self.buckets[band].append(cluster)
+        return cluster
+
+    def result(self) -> list:
+        return sorted(self.clusters, key=lambda cluster: cluster.count, reverse=True)
+
+
+def kubernetes_event_to_dict(event: dict) -> dict:
+    involved = event.get("involvedObject", {})
+    return {
+        "type":      event.get("type"),
+        "reason":    event.get("reason"),
+        "kind":      involved.get("kind"),
+        "name":      involved.get("name"),
+        "namespace": involved.get("namespace") or event.get("metadata", {}).get("namespace"),
+        "message":   event.get("message", ""),
+        "timestamp": event.get("lastTimestamp") or event.get("eventTime") or event.get("metadata", {}).get("creationTimestamp"),
+        "count":     event.get("count") or 1,
+    }
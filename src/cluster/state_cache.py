@@ -0,0 +1,252 @@
+import threading
+import time
+from collections import defaultdict
+from injectable import injectable
+from requests import RequestException
+
+from cluster.api_client import KubeApiClient
+
+WATCHED_KINDS = {
+    "pods":        "/api/v1/pods",
+    "deployments": "/apis/apps/v1/deployments",
+    "events":      "/api/v1/events",
+    "configmaps":  "/api/v1/configmaps",
+}
+LIST_PAGE_SIZE = 500
+WATCH_TIMEOUT_SECONDS = 300
+MAX_BACKOFF_SECONDS = 30
+
+
+def parse_label_selector(selector) -> dict:
+    """Accepts either a dict or an equality based selector string like "app=web,tier=db"."""
+    if not selector:
+        return {}
+    if isinstance(selector, dict):
+        return selector
+    labels = {}
+    for term in selector.split(","):
+        key, _, value = term.strip().partition("=")
+        labels[key.strip()] = value.lstrip("=").strip()
+    return labels
+
+
+class Informer:
+    """
+    Keeps an in-memory copy of one resource kind using list+watch.
+
+    The watch is resumed from the last seen resourceVersion (bookmarks included),
+    a full relist only happens when the server answers 410 Gone.
+    """
+
+    def __init__(self, client: KubeApiClient, kind: str, path: str):
+        self.client = client
+        self.kind = kind
+        self.path = path
+
+        self.lock = threading.RLock()
+        self.items = {}
+        self.by_namespace = defaultdict(set)
+        self.by_label = defaultdict(set)
+        self.by_owner = defaultdict(set)
+
+        self.handlers = []
+        self.resource_version = None
+        self.synced = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+# ================================================
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.__run, name=f"informer-{self.kind}", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def add_handler(self, handler):
+        """handler(event_type, obj) is called for every watch delta (not for the initial list)."""
+        self.handlers.append(handler)
+
+# ================================================
+    def __run(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self.__list()
+                error = self.__watch()
+                if error is None:
+                    backoff = 1
+                    continue
+                print(f"[informer-{self.kind}] watch error: {error}, retrying in {backoff}s")
+            except RequestException as e:
+                print(f"[informer-{self.kind}] connection error: {e}, retrying in {backoff}s")
+            except ValueError as e:
+                # a malformed or truncated line of the list or of the watch stream
+                print(f"[informer-{self.kind}] invalid response: {e}, retrying in {backoff}s")
+            self.stopped.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    def __list(self):
+        items = []
+        params = {"limit": LIST_PAGE_SIZE}
+        while True:
+            page = self.client.get(self.path, params=params)
+            items.extend(page.get("items", []))
+            metadata = page.get("metadata", {})
+            if not metadata.get("continue"):
+                break
+            params["continue"] = metadata["continue"]
+
+        with self.lock:
+            self.items.clear()
+            self.by_namespace.clear()
+            self.by_label.clear()
+            self.by_owner.clear()
+            for item in items:
+                self.__upsert(item)
+            self.resource_version = metadata.get("resourceVersion")
+        self.synced.set()
+
+    def __watch(self):
+        """Applies the watch events until the stream ends, returns the error status the server sent, if any."""
+        stream = self.client.watch(self.path, self.resource_version, timeout_seconds=WATCH_TIMEOUT_SECONDS)
+        try:
+            for event in stream:
+                if self.stopped.is_set():
+                    return None
+                event_type = event.get("type")
+                obj = event.get("object", {})
+
+                if event_type == "ERROR":
+                    # 410 Gone: our resourceVersion is too old, relist from scratch
+                    if obj.get("code") == 410:
+                        self.resource_version = None
+                        return None
+                    return f"{obj.get('code')} {obj.get('reason') or obj.get('message') or ''}".strip()
+
+                with self.lock:
+                    if event_type in ("ADDED", "MODIFIED"):
+                        self.__upsert(obj)
+                    elif event_type == "DELETED":
+                        self.__remove(self.__key(obj))
+                    self.resource_version = obj.get("metadata", {}).get("resourceVersion", self.resource_version)
+
+                if event_type != "BOOKMARK":
+                    for handler in self.handlers:
+                        try:
+                            handler(event_type, obj)
+                        except Exception as e:
+                            print(f"[informer-{self.kind}] handler error: {e}")
+        finally:
+            stream.close()
+
+# ================================================
+    def __key(self, obj):
+        metadata = obj.get("metadata", {})
+        return (metadata.get("namespace", ""), metadata.get("name"))
+
+    def __upsert(self, obj):
+        key = self.__key(obj)
+        if key in self.items:
+            self.__remove(key)
+
+        metadata = obj.get("metadata", {})
+        self.items[key] = obj
+        self.by_namespace[key[0]].add(key)
+        for label in (metadata.get("labels") or {}).items():
+            self.by_label[label].add(key)
+        for owner in metadata.get("ownerReferences") or []:
+            self.by_owner[owner.get("uid")].add(key)
+
+    def __remove(self, key):
+        obj = self.items.pop(key, None)
+        if obj is None:
+            return
+
+        metadata = obj.get("metadata", {})
+        self.__discard(self.by_namespace, key[0], key)
+        for label in (metadata.get("labels") or {}).items():
+            self.__discard(self.by_label, label, key)
+        for owner in metadata.get("ownerReferences") or []:
+            self.__discard(self.by_owner, owner.get("uid"), key)
+
+    def __discard(self, index, index_key, key):
+        keys = index.get(index_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+
+# ================================================
+    def get(self, namespace: str, name: str):
+        with self.lock:
+            return self.items.get((namespace or "", name))
+
+    def list(self, namespace: str = None, label_selector=None, owner_uid: str = None) -> list:
+        with self.lock:
+            candidates = None
+            if namespace is not None:
+                candidates = set(self.by_namespace.get(namespace, ()))
+            for label in parse_label_selector(label_selector).items():
+                keys = self.by_label.get(label, set())
+                candidates = set(keys) if candidates is None else candidates & keys
+            if owner_uid is not None:
+                keys = self.by_owner.get(owner_uid, set())
+                candidates = set(keys) if candidates is None else candidates & keys
+
+            if candidates is None:
+                return list(self.items.values())
+            return [self.items[key] for key in candidates]
+
+
+@injectable(singleton=True)
+class ClusterStateCache:
+    """
+    Shared informer-style cache of the cluster state used by the ClusterEventListener and by the agent tools
+    (PodLogsTool, QueryEventsTool) once it has synced.
+    Returned objects are the cached dicts themselves: callers must not modify them.
+    """
+
+    def __init__(self, client: KubeApiClient = None, kinds: dict = None):
+        self.client = client or KubeApiClient()
+        self.informers = {
+            kind: Informer(self.client, kind, path)
+            for kind, path in (WATCHED_KINDS if kinds is None else kinds).items()
+        }
+
+# ================================================
+    def start(self):
+        for informer in self.informers.values():
+            informer.start()
+        return self
+
+    def stop(self):
+        for informer in self.informers.values():
+            informer.stop()
+
+    def wait_for_sync(self, timeout: float = 30) -> bool:
+        deadline = time.monotonic() + timeout
+        for informer in self.informers.values():
+            if not informer.synced.wait(max(0, deadline - time.monotonic())):
+                return False
+        return True
+
+    def has_synced(self) -> bool:
+        return all(informer.synced.is_set() for informer in self.informers.values())
+
+    def add_handler(self, kind: str, handler):
+        self.informers[kind].add_handler(handler)
+
+# ================================================
+    def get(self, kind: str, namespace: str, name: str):
+        return self.informers[kind].get(namespace, name)
+
+    def list(self, kind: str, namespace: str = None, label_selector=None, owner_uid: str = None) -> list:
+        return self.informers[kind].list(namespace=namespace, label_selector=label_selector, owner_uid=owner_uid)
+
+    def owned_by(self, kind: str, owner: dict) -> list:
+        return self.list(kind, namespace=owner.get("metadata", {}).get("namespace"),
+                         owner_uid=owner.get("metadata", {}).get("uid"))
@@ -1,3 +1,4 @@
+import argparse
 from embedding.sme.kubepython_sme import KubePythonSme
 from embedding.sme.kubernetes_sme import KubernetesSme
 from bs4 import BeautifulSoup
@@ -14,7 +15,15 @@ def get_main_only(content: BeautifulSoup) -> str:
     return list_of_td[0].get_text() if len(content.select(".td-content")) == 1 else ""
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the vector DB collections")
+    parser.add_argument("--incremental", action="store_true", help="Only re-embed the sitemap pages that changed since the last run")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its last checkpoint")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
 #     with tempfile.TemporaryDirectory() as tmp:
 #         Repo.clone_from("https://github.com/kubernetes-client/python.git", tmp)
 #         sme1 = KubePythonSme()
@@ -24,7 +33,9 @@ def main():
     sme2.loadSiteMap(
         url="https://kubernetes.io/en/sitemap.xml",
         filter_urls=["https:\/\/kubernetes\.io\/docs\/.*"],
-        parsing_function=get_main_only)
+        parsing_function=get_main_only,
+        incremental=args.incremental,
+        resume=args.resume)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+K1 = 1.5
+B = 0.75
+
+# keeps kubernetes terms together (ImagePullBackOff, spec.containers.image, --dry-run)
+# and also indexes their parts, so both the exact term and the single words match
+TERM = re.compile(r'[a-z0-9]+(?:[._\-/][a-z0-9]+)*')
+TERM_PARTS = re.compile(r'[._\-/]')
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for term in TERM.findall(text.lower()):
+        tokens.append(term)
+        parts = TERM_PARTS.split(term)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """Local inverted index scoring documents with Okapi BM25."""
+
+    def __init__(self, ids: list, documents: list):
+        self.ids = ids
+        self.postings = defaultdict(list)
+        self.lengths = []
+
+        for position, document in enumerate(documents):
+            frequencies = Counter(tokenize(document or ""))
+            self.lengths.append(sum(frequencies.values()))
+            for term, frequency in frequencies.items():
+                self.postings[term].append((position, frequency))
+
+        count = max(len(self.lengths), 1)
+        self.average_length = (sum(self.lengths) / count) or 1
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query: str, k: int = 5, allowed=None) -> list:
+        """Returns the best [(id, score)]; allowed optionally restricts the candidates to a set of positions."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                if allowed is not None and position not in allowed:
+                    continue
+                norm = K1 * (1 - B + B * self.lengths[position] / self.average_length)
+                scores[position] += idf * frequency * (K1 + 1) / (frequency + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[position], score) for position, score in best]
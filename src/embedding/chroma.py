@@ -1,71 +1,463 @@
+import hashlib
 import time
+from collections import Counter
+from bs4 import BeautifulSoup
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import WebBaseLoader, SitemapLoader, DirectoryLoader, UnstructuredMarkdownLoader
-from langchain_openai import AzureOpenAIEmbeddings
+from langchain_community.document_loaders import WebBaseLoader, SitemapLoader, UnstructuredMarkdownLoader
 from langchain_community.vectorstores import Chroma
-from openai import RateLimitError
 
+from langchain_core.documents import Document
 from tqdm import tqdm
+import threading
+import uuid
 import os
+from pathlib import Path
+
+from embedding.bm25 import BM25Index
+from embedding.chunks import ChunkDeduplicator, assign_chunk_ids
+from embedding.diversity import estimate_tokens
+from embedding.embedding_scheduler import EMBED_BATCH_SIZE, EMBED_BATCH_TOKENS, EmbeddingScheduler
+from embedding.embeddings_creator import create_embeddings, get_embedding_backend
+from embedding.fetcher import FetchResult, PageFetcher
+from embedding.manifest import IngestionCheckpoint, IngestionManifest
+from embedding.pipeline import Batcher, Pipeline
+from embedding.quantized_index import CompactIndexLoader, QuantizedIndex, compact_index_path, export_vectors
+from embedding.retriever import SmeRetriever
+from embedding.sections import docs_page_metadata
+from embedding.snapshot import SnapshotSme, export_snapshot
 
-BATCH_SIZE = 20
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 100
+VERSION_CHECK_SECONDS = 1
+PAGE_POSITION = ("page_id", "chunk_index", "chunk_count")
+INGEST_PARSE_WORKERS = int(os.getenv('INGEST_PARSE_WORKERS', 4))
+INGEST_SPLIT_WORKERS = int(os.getenv('INGEST_SPLIT_WORKERS', 2))
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 64))
 
 class ChromaSme:
 
-    def __init__(self, db_index):
-        embeddings = AzureOpenAIEmbeddings(
-            api_key          = os.getenv('AZURE_API_KEY_GPT4'),
-            api_version      = os.getenv('AZURE_EMBEDDING_VERSION'),
-            azure_deployment = os.getenv('AZURE_EMBEDDING_MODEL'),
-            azure_endpoint   = os.getenv('AZURE_ENDPOINT'),
-        )
+    def __init__(self, db_index, embedding_backend: str = None):
+        self.collection_name = db_index
+        self.lexical_indexes = {}
+        self.lexical_version = None
+        self.lexical_lock = threading.Lock()
+        self.version = None
+        self.version_checked_at = 0
+        self.compact_index = CompactIndexLoader(db_index)
 
-        self.db = Chroma(
-            persist_directory  = os.getenv('VECTORIAL_DB_PATH'),
-            embedding_function = embeddings,
-            collection_name    = db_index
-        )
+        # the same backend is used to ingest and to query a collection, their vectors are not comparable
+        self.embedding_backend = embedding_backend or get_embedding_backend(db_index)
+        self.embeddings = create_embeddings(self.embedding_backend)
+        # opened on first use, a process serving the collection from its snapshot never opens Chroma
+        self.chroma = None
+        self.chroma_lock = threading.Lock()
+        self.snapshot_sme = None
+
+    @property
+    def db(self) -> Chroma:
+        if self.chroma is None:
+            with self.chroma_lock:
+                if self.chroma is None:
+                    self.chroma = Chroma(
+                        persist_directory  = os.getenv('VECTORIAL_DB_PATH'),
+                        embedding_function = self.embeddings,
+                        collection_name    = self.collection_name
+                    )
+        return self.chroma
 
 # ================================================
-    def __loadDocs(self, docs):
-        print(f"Loading {len(docs)} documents")
-        pbar = tqdm(range(0, len(docs), BATCH_SIZE))
-
-        for i in pbar:
-            end = min(i + BATCH_SIZE, len(docs))
-            batch = docs[i:end]
-            while True:
-                try:
-                    pbar.set_description(f"Processing {i}")
-                    self.db.add_documents(batch)
-                    break
-                except RateLimitError:
-                    pbar.set_description(f"Rate limit error, sleeping for a bit and retrying")
-                    pbar.refresh()
-                    time.sleep(10)
-
-        self.db.persist()
+    def __deduplicator(self) -> ChunkDeduplicator:
+        dedup = ChunkDeduplicator()
+        stored = self.db._collection.get(include=["metadatas"])
+        dedup.load(stored["ids"], stored["metadatas"])
+        return dedup
+
+    def __detachPage(self, url: str, dedup: ChunkDeduplicator):
+        # the chunks the page shares with other pages stay for them, its own are deleted by __prunePage
+        with dedup.lock:
+            updates, moves = dedup.detach(url)
+            self.__moveChunks(moves)
+            if updates:
+                self.db._collection.update(ids=list(updates), metadatas=list(updates.values()))
+
+    def __moveChunks(self, moves: dict):
+        # copies the stored chunks to their new ids, the old ids are overwritten or pruned with their page
+        if moves:
+            moved = self.db._collection.get(ids=list(moves), include=["embeddings", "documents", "metadatas"])
+            if moved["ids"]:
+                self.db._collection.upsert(
+                    ids        = [moves[id][0] for id in moved["ids"]],
+                    embeddings = moved["embeddings"],
+                    documents  = moved["documents"],
+                    metadatas  = [
+                        {**{key: value for key, value in metadata.items() if key not in PAGE_POSITION}, **moves[id][1]}
+                        for id, metadata in zip(moved["ids"], moved["metadatas"])
+                    ],
+                )
+
+    def __prunePage(self, url: str, keep: list, dedup: ChunkDeduplicator):
+        # once the new chunks of the page are stored: the old ones it did not store again (the tail of a page
+        # that got shorter, chunks ingested without stable ids or content hashes), all of them for a removed page
+        with dedup.lock:
+            keep = set(keep)
+            stale = [id for id in self.db._collection.get(where={"source": url}, include=[])["ids"] if id not in keep]
+            stale, moves = dedup.prune(url, stale)
+            self.__moveChunks(moves)
+            if stale:
+                self.db._collection.delete(ids=stale)
+                dedup.dropped(stale)
+
+    def __updateSources(self, dedup: ChunkDeduplicator):
+        with dedup.lock:
+            updates = dedup.updates()
+            if updates:
+                self.db._collection.update(ids=list(updates), metadatas=list(updates.values()))
+
+    def __ingest(self, source, parse=None, version: str = None, on_page=None,
+                 dedup: ChunkDeduplicator = None, checkpoint: IngestionCheckpoint = None) -> dict:
+        """
+        Streams the pages of source through parse -> split -> dedup -> embed -> upsert, stages connected by
+        bounded queues (see Pipeline): the first chunks are stored while later pages are still being fetched,
+        and memory does not grow with the number of pages. parse turns a source item into a Document (None
+        skips it), version adds the docs section metadata. Every page is detached from the chunks it shares before
+        its new chunks are added; once all of them are stored its previous chunks that were not stored again are
+        deleted, then on_page(url, chunk ids) and checkpoint.add are called: an interrupted run never leaves a page
+        without its chunks.
+        Chunks with the same content as one already in the collection are not embedded again (see
+        ChunkDeduplicator), nor are the ones a previous run already stored under the same id.
+        """
+        dedup = dedup or self.__deduplicator()
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        pending, waiting, pending_lock = {}, {}, threading.Lock()
+        unchanged, refresh = Counter(), []
+        scheduler = EmbeddingScheduler(self.embeddings)
+        progress = tqdm(desc="Embedding", unit="chunk")
+
+        def parse_page(item):
+            doc = parse(item)
+            return [doc] if doc is not None else []
+
+        def split(page: Document):
+            url = page.metadata["source"]
+            docs = splitter.split_documents([page])
+            # section, path and version allow the retriever to search only a part of the docs
+            if version:
+                for doc in docs:
+                    doc.metadata.update(docs_page_metadata(url, version))
+            # parent page and chunk order allow the retriever to expand a hit to its neighbors
+            ids = assign_chunk_ids(docs)
+            # the page may have changed since its chunks were stored, what it shared is released before they are added again
+            self.__detachPage(url, dedup)
+            if not docs:
+                page_done(url, [])
+                return []
+            with pending_lock:
+                pending[url] = [len(docs), []]
+            return list(zip(ids, docs))
+
+        def page_done(url: str, chunk_ids: list):
+            self.__prunePage(url, chunk_ids, dedup)
+            if checkpoint:
+                checkpoint.add(url, chunk_ids)
+            if on_page:
+                on_page(url, chunk_ids)
+
+        def chunk_done(doc: Document, stored_id: str):
+            url = doc.metadata["source"]
+            with pending_lock:
+                pending[url][0] -= 1
+                pending[url][1].append(stored_id)
+                if pending[url][0]:
+                    return
+                _, chunk_ids = pending.pop(url)
+            page_done(url, sorted(chunk_ids))
+
+        def deduplicate(item: tuple):
+            id, doc = item
+            stored_id = dedup.add(id, doc)
+            with dedup.lock:
+                # an id that had another content: the pages sharing the old one keep it under a content id
+                self.__moveChunks(dedup.moved())
+                stored = dedup.is_stored(stored_id, doc.metadata["content_hash"])
+                if stored_id == id and not stored:
+                    return [item]
+                if not stored:
+                    # a copy counts as stored with the chunk it copies
+                    waiting.setdefault(stored_id, []).append(doc)
+                    return []
+            if stored_id == id:
+                # stored by a previous (or interrupted) run with the same content: only the metadata is refreshed
+                refresh.append((id, doc))
+                if len(refresh) >= EMBED_BATCH_SIZE:
+                    refresh_metadata()
+                return []
+            self.__updateSources(dedup)
+            chunk_done(doc, stored_id)
+            return []
+
+        def refresh_metadata():
+            batch = refresh[:]
+            refresh.clear()
+            if batch:
+                self.db._collection.update(ids=[id for id, _ in batch], metadatas=[{**doc.metadata, **dedup.store(id)} for id, doc in batch])
+                unchanged["chunks"] += len(batch)
+            for id, doc in batch:
+                chunk_done(doc, id)
+            return []
+
+        deduplicate.flush = refresh_metadata
+
+        def embed(batch: list):
+            texts = [doc.page_content for _, doc in batch]
+            return [(batch, scheduler.embed(texts, sum(estimate_tokens(text) for text in texts)))]
+
+        def upsert(item: tuple):
+            batch, embeddings = item
+            with dedup.lock:
+                metadatas = [{**doc.metadata, **dedup.store(id)} for id, doc in batch]
+                copies = [(id, copy) for id, _ in batch for copy in waiting.pop(id, [])]
+            self.db._collection.upsert(
+                ids        = [id for id, _ in batch],
+                embeddings = embeddings,
+                metadatas  = metadatas,
+                documents  = [doc.page_content for _, doc in batch],
+            )
+            stats = scheduler.stats()
+            progress.set_postfix_str(f"{stats['tokens_per_second']:.0f} tokens/s, {stats['concurrency']} in flight, {stats['rate_limited']} rate limited")
+            progress.update(len(batch))
+            self.__updateSources(dedup)
+            for id, doc in batch + copies:
+                chunk_done(doc, id)
+
+        stages = [("parse", parse_page, INGEST_PARSE_WORKERS)] if parse else []
+        stages += [
+            ("split", split, INGEST_SPLIT_WORKERS),
+            ("dedup", deduplicate, 1),
+            ("batch", Batcher(EMBED_BATCH_SIZE, EMBED_BATCH_TOKENS, lambda item: estimate_tokens(item[1].page_content)), 1),
+            # as many workers as requests may be in flight, the scheduler decides how many actually are
+            ("embed", embed, scheduler.max_concurrency),
+            ("upsert", upsert, 1),
+        ]
+        pipeline = Pipeline(stages, queue_size=INGEST_QUEUE_SIZE)
+        try:
+            stats = pipeline.run(source)
+        finally:
+            progress.close()
+            self.__updateSources(dedup)
+            # the pages completed before a failure are not fetched again by a resumed run
+            if checkpoint:
+                checkpoint.flush()
+            # also after a failure, what was already stored must not be served from stale caches
+            if pipeline.counts["split"]:
+                self.db.persist()
+                self.bumpVersion()
+        stats.update(scheduler.stats())
+        stats.update(duplicates=dedup.duplicates, unchanged=unchanged["chunks"])
+        print(f"Ingested {stats['split']} pages, {progress.n} chunks embedded ({dedup.duplicates} duplicates, {unchanged['chunks']} already stored) "
+              f"in {stats['seconds']}s ({stats['tokens_per_second']} tokens/s)")
+        return stats
 
 # ================================================
-    def loadWebDocument(self, url: str):
-        loader = WebBaseLoader(url)
-        docs = loader.load_and_split(RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP))
-        self.__loadDocs(docs)
+    def loadWebDocument(self, url: str, resume: bool = False):
+        checkpoint = IngestionCheckpoint(self.collection_name, resume)
+        if url not in checkpoint.done:
+            self.__ingest([url], parse=lambda url: WebBaseLoader(url).load()[0], checkpoint=checkpoint)
+        checkpoint.finish()
 
 # ================================================
-    def loadSiteMap(self, url: str, filter_urls: [str], parsing_function=None):
+    def loadSiteMap(self, url: str, filter_urls: [str], parsing_function=None, version: str = None, incremental: bool = False, resume: bool = False):
         loader = SitemapLoader(url, filter_urls=filter_urls, parsing_function=parsing_function)
-        docs = loader.load_and_split(RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP))
-        self.__loadDocs(docs)
+        version = version or os.getenv('K8S_DOCS_VERSION', "latest")
+        pages = {page["loc"].strip(): page for page in loader.parse_sitemap(loader._scrape(loader.web_path, parser="xml")) if "loc" in page}
+        if incremental:
+            # the manifest is written page by page, an interrupted incremental run simply resumes on the next one
+            self.__loadSiteMapIncremental(loader, pages, version)
+            return
+
+        checkpoint = IngestionCheckpoint(self.collection_name, resume)
+        urls = [url for url in pages if url not in checkpoint.done]
+        fetched = tqdm(PageFetcher().fetch_all(urls), total=len(urls), desc="Fetching pages")
+        self.__ingest(fetched, parse=lambda result: self.__parsePage(loader, pages, result), version=version, checkpoint=checkpoint)
+        checkpoint.finish()
+
+    def __parsePage(self, loader: SitemapLoader, pages: dict, result: FetchResult) -> Document:
+        """The Document of a downloaded sitemap page, None on 304 or failure."""
+        if not result.ok:
+            print(f"Skipping {result.url}: {result.error}")
+            return None
+        if result.not_modified:
+            return None
+        soup = BeautifulSoup(result.text, "html.parser")
+        doc = Document(page_content=loader.parsing_function(soup), metadata=loader.meta_function(pages[result.url], soup))
+        doc.metadata["source"] = result.url
+        return doc
+
+    def __loadSiteMapIncremental(self, loader: SitemapLoader, pages: dict, version: str):
+        # only the pages whose sitemap lastmod, HTTP validators or parsed content changed since the last run are re-embedded
+        manifest = IngestionManifest()
+        known = manifest.pages(self.collection_name)
+
+        candidates = [
+            url for url, page in pages.items()
+            if url not in known or not page.get("lastmod") or page["lastmod"] != known[url]["lastmod"]
+        ]
+        removed = [url for url in known if url not in pages]
+        print(f"{len(pages)} pages in the sitemap: {len(pages) - len(candidates)} not modified, {len(candidates)} to check, {len(removed)} removed")
+
+        dedup = self.__deduplicator()
+        counts, counts_lock = Counter(), threading.Lock()
+        changed = {}
+
+        def parse(result: FetchResult):
+            url, doc = result.url, self.__parsePage(loader, pages, result)
+            if not result.ok:
+                with counts_lock:
+                    counts["failed"] += 1
+                return None
+            if doc is None:
+                # 304: the server confirms the stored content
+                manifest.put(self.collection_name, url, pages[url].get("lastmod"), known[url]["content_hash"], known[url]["chunks"], result.etag, result.last_modified)
+                with counts_lock:
+                    counts["unchanged"] += 1
+                return None
+
+            content_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+            if url in known and known[url]["content_hash"] == content_hash:
+                manifest.put(self.collection_name, url, pages[url].get("lastmod"), content_hash, known[url]["chunks"], result.etag, result.last_modified)
+                with counts_lock:
+                    counts["unchanged"] += 1
+                return None
+            changed[url] = (result, content_hash)
+            with counts_lock:
+                counts["updated"] += 1
+            return doc
+
+        def on_page(url: str, chunk_ids: list):
+            # the page is recorded only once all its new chunks are stored
+            result, content_hash = changed.pop(url)
+            manifest.put(self.collection_name, url, pages[url].get("lastmod"), content_hash, len(chunk_ids), result.etag, result.last_modified)
+
+        validators = {url: (known[url]["etag"], known[url]["last_modified"]) for url in candidates if url in known}
+        fetched = tqdm(PageFetcher().fetch_all(candidates, validators), total=len(candidates), desc="Fetching pages")
+        self.__ingest(fetched, parse=parse, version=version, on_page=on_page, dedup=dedup)
+
+        for url in removed:
+            self.__detachPage(url, dedup)
+            self.__prunePage(url, [], dedup)
+            manifest.delete(self.collection_name, url)
+        if removed:
+            self.bumpVersion()
+        print(f"Incremental ingestion done: {counts['updated']} pages re-embedded, {counts['unchanged']} unchanged, {len(removed)} removed, {counts['failed']} failed")
 
 # ================================================
-    def loadMarkdown(self, directory: str):
-        loader = DirectoryLoader(directory, glob="**/*.md", use_multithreading=True, show_progress=True, loader_cls=UnstructuredMarkdownLoader)
-        docs = loader.load_and_split(RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP))
-        self.__loadDocs(docs)
+    def loadMarkdown(self, directory: str, resume: bool = False):
+        checkpoint = IngestionCheckpoint(self.collection_name, resume)
+        paths = sorted(str(path) for path in Path(directory).rglob("*.md") if path.is_file() and str(path) not in checkpoint.done)
+        self.__ingest(tqdm(paths, desc="Parsing markdown"), parse=lambda path: UnstructuredMarkdownLoader(path).load()[0], checkpoint=checkpoint)
+        checkpoint.finish()
 
 # ================================================
     def getDb(self):
-        return self.db
\ No newline at end of file
+        return self.db
+
+# ================================================
+    def embedQuery(self, query: str) -> [float]:
+        return self.embeddings.embed_query(query)
+
+    async def aembedQuery(self, query: str) -> [float]:
+        return await self.embeddings.aembed_query(query)
+
+# ================================================
+    def queryByVector(self, embedding: [float], k: int = 5, where: dict = None) -> list:
+        """Vector search returning [(id, Document, distance)], the ids are needed to fuse different rankings."""
+        result = self.db._collection.query(
+            query_embeddings = [embedding],
+            n_results        = k,
+            where            = where,
+            include          = ["documents", "metadatas", "distances"],
+        )
+        return [
+            (id, Document(page_content=document, metadata=metadata or {}), distance)
+            for id, document, metadata, distance in zip(result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0])
+        ]
+
+# ================================================
+    def getDocuments(self, ids: [str]) -> dict:
+        result = self.db.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            id: Document(page_content=document, metadata=metadata or {})
+            for id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        }
+
+# ================================================
+    def getEmbeddings(self, ids: [str]) -> dict:
+        result = self.db.get(ids=ids, include=["embeddings"])
+        return dict(zip(result["ids"], result["embeddings"]))
+
+# ================================================
+    def getLexicalIndex(self, section: str = None) -> BM25Index:
+        # built lazily from the stored chunks (one per docs section) and rebuilt after every ingestion
+        with self.lexical_lock:
+            version = self.getVersion()
+            if version != self.lexical_version:
+                self.lexical_indexes = {}
+                self.lexical_version = version
+            if section not in self.lexical_indexes:
+                result = self.db.get(where={"section": section} if section else None, include=["documents"])
+                self.lexical_indexes[section] = BM25Index(result["ids"], result["documents"])
+            return self.lexical_indexes[section]
+
+# ================================================
+    def buildCompactIndex(self, method: str = "int8") -> QuantizedIndex:
+        version = self.getVersion()
+        ids, vectors = export_vectors(self)
+        index = QuantizedIndex.build(ids, vectors, method=method)
+        index.version = version
+        index.save(compact_index_path(self.collection_name))
+        return index
+
+    def getCompactIndex(self) -> QuantizedIndex:
+        """The quantized index of the collection, None if it was not built or is older than the collection."""
+        return self.compact_index.get(self.getVersion())
+
+# ================================================
+    def __versionPath(self) -> str:
+        return os.path.join(os.getenv('VECTORIAL_DB_PATH') or ".", "versions", f"{self.collection_name}.version")
+
+    def getVersion(self) -> str:
+        """Stamp of the collection content, changed by every ingestion run (also by other processes)."""
+        now = time.monotonic()
+        if self.version is None or now - self.version_checked_at >= VERSION_CHECK_SECONDS:
+            try:
+                with open(self.__versionPath(), 'r') as file:
+                    self.version = file.read().strip()
+            except FileNotFoundError:
+                self.version = "0"
+            self.version_checked_at = now
+        return self.version
+
+    def bumpVersion(self) -> str:
+        path = self.__versionPath()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        version = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        with open(f"{path}.tmp", 'w') as file:
+            file.write(version)
+        os.replace(f"{path}.tmp", path)
+        self.version = version
+        self.version_checked_at = time.monotonic()
+        return version
+
+# ================================================
+    def exportSnapshot(self) -> str:
+        return export_snapshot(self)
+
+    def getRetriever(self, snapshot: bool = None, **kwargs) -> SmeRetriever:
+        # with SME_SNAPSHOTS=true the processes search the shared memory-mapped snapshot instead of their own index
+        if snapshot is None:
+            snapshot = os.getenv('SME_SNAPSHOTS', "false").lower() == "true"
+        if snapshot and SnapshotSme.exists(self.collection_name):
+            # one per collection: the snapshot and its lexical and compact indexes are shared by every retriever
+            if self.snapshot_sme is None:
+                self.snapshot_sme = SnapshotSme(self.collection_name, self.embeddings)
+            return SmeRetriever(sme=self.snapshot_sme, **kwargs)
+        return SmeRetriever(sme=self, **kwargs)
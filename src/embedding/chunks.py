@@ -0,0 +1,205 @@
+import hashlib
+import threading
+
+from embedding.diversity import text_overlap
+
+
+def page_id(source: str) -> str:
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_id(page: str, index: int) -> str:
+    return f"{page}-{index:04d}"
+
+
+def assign_chunk_ids(docs: list) -> list:
+    """
+    Adds the parent page (page_id) and the position of every chunk in it (chunk_index, chunk_count)
+    to the metadata of split documents, in splitter order, and returns their stable ids.
+    The same page split the same way always gets the same ids, so ingestion can upsert.
+    """
+    counts = {}
+    for doc in docs:
+        page = page_id(doc.metadata.get("source", ""))
+        doc.metadata["page_id"] = page
+        doc.metadata["chunk_index"] = counts.get(page, 0)
+        counts[page] = doc.metadata["chunk_index"] + 1
+    for doc in docs:
+        doc.metadata["chunk_count"] = counts[doc.metadata["page_id"]]
+    return [chunk_id(doc.metadata["page_id"], doc.metadata["chunk_index"]) for doc in docs]
+
+
+def join_chunks(texts: list) -> str:
+    """Joins consecutive chunks of a page dropping the overlap the splitter repeated between them."""
+    joined = ""
+    for text in texts:
+        if not joined:
+            joined = text
+        elif text not in joined:
+            overlap = text_overlap(joined, text)
+            joined += text[overlap:] if overlap else f"\n{text}"
+    return joined
+
+
+def chunk_hash(text: str) -> str:
+    # whitespace differences (indentation of copied snippets, wrapping) do not make a different chunk
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def shared_chunk_id(content_hash: str) -> str:
+    return f"shared-{content_hash[:24]}"
+
+
+class ChunkDeduplicator:
+    """
+    Keeps one stored chunk per normalized content: feature-state banners, "What's next" lists and common
+    snippets repeated by many pages are embedded once and list every page in their "sources" metadata
+    (space separated, the first one is also "source").
+
+    When the page a shared chunk was cut from goes away (re-ingested or removed), detach() moves the chunk
+    to a content id so the ids of the page stay free for its new chunks; add() does the same when an id gets
+    a different content (see moved()). Methods are thread safe, lock is also held by the caller around the
+    collection writes that must follow the state they read.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.canonical = {}
+        self.hashes = {}
+        self.sources = {}
+        self.pages = {}
+        # {id: content hash} of what the collection holds under the id, until it is overwritten or deleted
+        self.stored = {}
+        self.dirty = set()
+        self.pending_moves = {}
+        self.duplicates = 0
+
+    def load(self, ids: list, metadatas: list):
+        """Starts from the chunks already in the collection (those stored before deduplication are ignored)."""
+        with self.lock:
+            for id, metadata in zip(ids, metadatas):
+                content_hash = (metadata or {}).get("content_hash")
+                if not content_hash:
+                    continue
+                self.stored[id] = content_hash
+                if content_hash not in self.canonical:
+                    self.__register(id, content_hash, (metadata.get("sources") or metadata["source"]).split())
+
+    def __register(self, id: str, content_hash: str, sources: list):
+        self.canonical[content_hash] = id
+        self.hashes[id] = content_hash
+        self.sources[id] = sources
+        for source in sources:
+            self.pages.setdefault(source, set()).add(id)
+
+    def __forget(self, id: str):
+        for source in self.sources.pop(id):
+            self.pages.get(source, set()).discard(id)
+        self.canonical.pop(self.hashes.pop(id), None)
+        self.dirty.discard(id)
+
+    def __move(self, id: str, sources: list, moves: dict):
+        # the chunk leaves its id, its content stays under a content id for the pages still listing it
+        content_hash = self.hashes[id]
+        stored = self.stored.get(id) == content_hash
+        self.__forget(id)
+        if not sources:
+            return
+        new_id = shared_chunk_id(content_hash)
+        self.__register(new_id, content_hash, sources)
+        if stored:
+            self.stored[new_id] = content_hash
+        moves[id] = (new_id, {"source": sources[0], "sources": " ".join(sources)})
+
+# ================================================
+    def add(self, id: str, doc) -> str:
+        """Records the chunk, returns the id of the chunk keeping its content: its own id unless it is a copy."""
+        content_hash = doc.metadata["content_hash"] = chunk_hash(doc.page_content)
+        source = doc.metadata["source"]
+        with self.lock:
+            previous = self.hashes.get(id)
+            if previous is not None and previous != content_hash:
+                # the id gets a new content: its old hash and sources go, the other pages keep the old content
+                self.__move(id, [other for other in self.sources[id] if other != source], self.pending_moves)
+            first = self.canonical.get(content_hash)
+            if first is None or first == id:
+                if first is None:
+                    self.__register(id, content_hash, [source])
+                return id
+            if source not in self.sources[first]:
+                self.sources[first].append(source)
+                self.pages.setdefault(source, set()).add(first)
+                if self.stored.get(first) == content_hash:
+                    self.dirty.add(first)
+            self.duplicates += 1
+            return first
+
+    def is_stored(self, id: str, content_hash: str) -> bool:
+        """Whether the collection already holds this content under id, a changed chunk must be embedded again."""
+        with self.lock:
+            return self.stored.get(id) == content_hash
+
+    def store(self, id: str) -> dict:
+        """Metadata to store with a kept chunk, from now on new sources of it are returned by updates()."""
+        with self.lock:
+            self.stored[id] = self.hashes.get(id)
+            self.dirty.discard(id)
+            sources = self.sources.get(id, [])
+            return {"sources": " ".join(sources)} if sources else {}
+
+    def dropped(self, ids: list):
+        """The chunks were deleted from the collection."""
+        with self.lock:
+            for id in ids:
+                if id in self.hashes:
+                    self.__forget(id)
+                self.stored.pop(id, None)
+
+    def prune(self, source: str, ids: list) -> tuple:
+        """
+        Of the stale chunks of a page, returns (ids to delete, moves): a content id that other pages started to
+        list after the page was detached stays for them, with the next page as its source.
+        """
+        moves = {}
+        with self.lock:
+            for id in ids:
+                sources = [other for other in self.sources.get(id, []) if other != source]
+                if sources:
+                    self.__move(id, sources, moves)
+            return [id for id in ids if id not in moves], moves
+
+    def moved(self) -> dict:
+        """{id: (new id, metadata)} of the chunks add() moved off their id since the last call, to copy before the id is overwritten."""
+        with self.lock:
+            moves, self.pending_moves = self.pending_moves, {}
+            return moves
+
+    def updates(self) -> dict:
+        """{id: metadata} of the stored chunks that got new sources since they were stored."""
+        with self.lock:
+            updates = {id: {"sources": " ".join(self.sources[id])} for id in self.dirty}
+            self.dirty.clear()
+            return updates
+
+    def detach(self, source: str) -> tuple:
+        """
+        Removes a page from the chunks it shares, returns (updates, moves): {id: metadata} of the chunks it
+        was a secondary source of and {id: (new id, metadata)} of the chunks cut from it that other pages keep.
+        The chunks only the page had are forgotten, the caller deletes them once the new chunks of the page are stored.
+        A content id the page is the last source of stays registered: the page finds its stored content (and vector)
+        again when it still has it, otherwise the caller deletes it with the other chunks of the page.
+        """
+        updates, moves, kept = {}, {}, set()
+        with self.lock:
+            for id in sorted(self.pages.pop(source, set())):
+                sources = [other for other in self.sources[id] if other != source]
+                if not sources and id == shared_chunk_id(self.hashes[id]):
+                    kept.add(id)
+                elif sources and self.sources[id][0] != source:
+                    self.sources[id] = sources
+                    updates[id] = {"sources": " ".join(sources)}
+                else:
+                    self.__move(id, sources, moves)
+            if kept:
+                self.pages[source] = kept
+        return updates, moves
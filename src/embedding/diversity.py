@@ -0,0 +1,93 @@
+import numpy as np
+from langchain_core.documents import Document
+
+CHARS_PER_TOKEN = 4
+DUPLICATE_THRESHOLD = 0.95
+MIN_OVERLAP = 30
+MAX_OVERLAP = 400
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def mmr(query_embedding, embeddings, k: int, lambda_mult: float = 0.5, duplicate_threshold: float = DUPLICATE_THRESHOLD, relevance=None) -> list:
+    """
+    Maximal marginal relevance over the candidate vectors, returns the selected positions.
+    Candidates almost identical to an already selected one are dropped instead of just penalized.
+    relevance can replace the similarity to the query (e.g. reranker scores).
+    """
+    if len(embeddings) == 0:
+        return []
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    if relevance is None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+        relevance = (relevance - relevance.min()) / max(float(relevance.max() - relevance.min()), 1e-12)
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    selected = []
+
+    while len(selected) < k and available.any():
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+
+        similarity = vectors @ vectors[best]
+        redundancy = np.maximum(redundancy, similarity)
+        available &= similarity < duplicate_threshold
+    return selected
+
+
+def text_overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of first that is a prefix of second."""
+    for size in range(min(len(first), len(second), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def merge_overlapping(documents: list) -> list:
+    """
+    Merges chunks of the same source that overlap (the splitter repeats CHUNK_OVERLAP characters)
+    or contain one another, keeping the position of the best ranked chunk.
+    """
+    merged = []
+    for document in documents:
+        source = document.metadata.get("source")
+        text = document.page_content
+        for index, passage in enumerate(merged):
+            if source is None or passage.metadata.get("source") != source:
+                continue
+            current = passage.page_content
+            if text in current:
+                break
+            if current in text:
+                merged[index] = Document(page_content=text, metadata=passage.metadata)
+                break
+            after = text_overlap(current, text)
+            before = text_overlap(text, current)
+            if after or before:
+                joined = current + text[after:] if after >= before else text + current[before:]
+                merged[index] = Document(page_content=joined, metadata=passage.metadata)
+                break
+        else:
+            merged.append(document)
+    return merged
+
+
+def within_budget(documents: list, token_budget: int) -> list:
+    kept = []
+    used = 0
+    for document in documents:
+        tokens = estimate_tokens(document.page_content)
+        if kept and used + tokens > token_budget:
+            break
+        kept.append(document)
+        used += tokens
+    return kept
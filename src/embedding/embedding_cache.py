@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+MEMORY_ENTRIES = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 2048))
+CACHE_FILE = "query_embedding_cache.sqlite"
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Two level cache of query embeddings: an in-memory LRU in front of a sqlite file,
+    so the entries survive restarts and are shared by the processes of the pod.
+    """
+
+    def __init__(self, path: str = None, memory_entries: int = MEMORY_ENTRIES):
+        self.path = path or os.getenv('QUERY_EMBEDDING_CACHE_PATH') or os.path.join(os.getenv('VECTORIAL_DB_PATH', "."), CACHE_FILE)
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+        with self.__connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+# ================================================
+    def __connection(self) -> sqlite3.Connection:
+        # sqlite connections can not be shared between threads
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = self.local.connection = sqlite3.connect(self.path, timeout=10)
+        return connection
+
+    def key(self, text: str, model_key: str) -> str:
+        return hashlib.sha256(f"{model_key}\n{normalize_query(text)}".encode()).hexdigest()
+
+# ================================================
+    def get_memory(self, key: str):
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+            return vector
+
+    def get(self, key: str):
+        vector = self.get_memory(key)
+        if vector is not None:
+            return vector
+
+        row = self.__connection().execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        with self.lock:
+            self.disk_hits += 1
+            self.__remember(key, vector)
+        return vector
+
+    def put(self, key: str, vector: List[float], seconds: float):
+        with self.lock:
+            self.misses += 1
+            self.miss_seconds += seconds
+            self.__remember(key, vector)
+        with self.__connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?)",
+                               (key, np.asarray(vector, dtype=np.float32).tobytes()))
+
+    def __remember(self, key: str, vector: List[float]):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+# ================================================
+    def stats(self) -> dict:
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            average_miss = self.miss_seconds / self.misses if self.misses else 0
+            return {
+                "lookups":             lookups,
+                "memory_hits":         self.memory_hits,
+                "disk_hits":           self.disk_hits,
+                "misses":              self.misses,
+                "hit_rate":            hits / lookups if lookups else 0,
+                "memory_entries":      len(self.memory),
+                "avg_miss_seconds":    average_miss,
+                "saved_seconds":       hits * average_miss,
+            }
+
+
+query_embedding_cache = None
+query_embedding_cache_lock = threading.Lock()
+
+
+def getQueryEmbeddingCache() -> QueryEmbeddingCache:
+    """The cache shared by every ChromaSme of the process."""
+    global query_embedding_cache
+    with query_embedding_cache_lock:
+        if query_embedding_cache is None:
+            query_embedding_cache = QueryEmbeddingCache()
+        return query_embedding_cache
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embedding model caching embed_query; documents (ingestion) are not cached.
+    model_key must identify the model (e.g. deployment and version): vectors of different models never mix.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_key: str, cache: QueryEmbeddingCache = None):
+        self.embeddings = embeddings
+        self.model_key = model_key
+        self.cache = cache or getQueryEmbeddingCache()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.cache.key(text, self.model_key)
+        vector = self.cache.get(key)
+        if vector is None:
+            start = time.perf_counter()
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector, time.perf_counter() - start)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.cache.key(text, self.model_key)
+        vector = self.cache.get_memory(key)
+        if vector is None:
+            # the sqlite lookup is blocking
+            vector = await asyncio.to_thread(self.cache.get, key)
+        if vector is None:
+            start = time.perf_counter()
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, key, vector, time.perf_counter() - start)
+        return vector
@@ -0,0 +1,148 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import List
+from langchain_core.embeddings import Embeddings
+from openai import RateLimitError
+
+from embedding.diversity import estimate_tokens
+from embedding.fetcher import retry_after_seconds
+
+EMBED_BATCH_TOKENS = int(os.getenv('EMBED_BATCH_TOKENS', 8000))
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 256))
+# budgets of the embedding deployment, 0 when it has none (e.g. onnx)
+EMBED_TPM = int(os.getenv('EMBED_TPM', 0))
+EMBED_RPM = int(os.getenv('EMBED_RPM', 0))
+EMBED_MAX_CONCURRENCY = int(os.getenv('EMBED_MAX_CONCURRENCY', 8))
+EMBED_RETRIES = int(os.getenv('EMBED_RETRIES', 8))
+WINDOW_SECONDS = 60
+INCREASE_AFTER = 4
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+
+def rate_limit_delay(error: RateLimitError) -> float:
+    """Seconds the server asked to wait (retry-after-ms or Retry-After), None without a hint."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    milliseconds = response.headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+    return retry_after_seconds(response)
+
+
+class EmbeddingScheduler:
+    """
+    Sends embedding requests from many threads within the budgets of the deployment.
+
+    The requests of the last minute are tracked against the tokens per minute (tpm) and requests per
+    minute (rpm) budgets, a request waits until it fits. Concurrency grows by one after INCREASE_AFTER
+    successful batches and is halved on every rate limit error (up to max_concurrency in flight); a rate
+    limit also pauses every request for the Retry-After of the server, or an exponential backoff with jitter.
+    """
+
+    def __init__(self, embeddings: Embeddings, tpm: int = EMBED_TPM, rpm: int = EMBED_RPM,
+                 max_concurrency: int = EMBED_MAX_CONCURRENCY, retries: int = EMBED_RETRIES):
+        self.embeddings = embeddings
+        self.tpm = tpm
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+
+        self.limit = max(1, max_concurrency // 2)
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.window = deque()
+        self.condition = threading.Condition()
+
+        self.started = time.monotonic()
+        self.tokens = 0
+        self.requests = 0
+        self.rate_limited = 0
+
+# ================================================
+    def __window_delay(self, tokens: int, now: float) -> float:
+        """Seconds before a request of tokens fits in the budgets of the last minute."""
+        while self.window and self.window[0][0] <= now - WINDOW_SECONDS:
+            self.window.popleft()
+        delay = 0.0
+        if self.rpm and len(self.window) >= self.rpm:
+            delay = self.window[len(self.window) - self.rpm][0] + WINDOW_SECONDS - now
+        used = sum(used_tokens for _, used_tokens in self.window)
+        if self.tpm and self.window and used + tokens > self.tpm:
+            # until enough of the oldest requests leave the window, a batch larger than the budget waits for all of them
+            excess = used + tokens - self.tpm
+            for sent_at, used_tokens in self.window:
+                excess -= used_tokens
+                if excess <= 0:
+                    break
+            delay = max(delay, sent_at + WINDOW_SECONDS - now)
+        return delay
+
+    def __acquire(self, tokens: int):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                delay = max(self.paused_until - now, self.__window_delay(tokens, now))
+                if delay <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    self.window.append((now, tokens))
+                    return
+                self.condition.wait(timeout=delay if delay > 0 else None)
+
+    def __release(self, tokens: int = None):
+        with self.condition:
+            self.in_flight -= 1
+            if tokens is not None:
+                self.tokens += tokens
+                self.requests += 1
+                self.successes += 1
+                if self.successes >= INCREASE_AFTER and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def __throttle(self, delay: float):
+        with self.condition:
+            self.rate_limited += 1
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.condition.notify_all()
+
+# ================================================
+    def embed(self, texts: List[str], tokens: int = None) -> List[List[float]]:
+        tokens = tokens or sum(estimate_tokens(text) for text in texts)
+        for attempt in range(self.retries + 1):
+            self.__acquire(tokens)
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except RateLimitError as e:
+                self.__release()
+                if attempt == self.retries:
+                    raise
+                delay = rate_limit_delay(e)
+                self.__throttle(delay if delay is not None else random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+                continue
+            except Exception:
+                self.__release()
+                raise
+            self.__release(tokens)
+            return vectors
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "tokens": self.tokens,
+            "requests": self.requests,
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed > 0 else 0.0,
+            "concurrency": self.limit,
+            "rate_limited": self.rate_limited,
+        }
@@ -0,0 +1,38 @@
+from langchain_openai import AzureOpenAIEmbeddings
+from embedding.embedding_cache import CachedQueryEmbeddings
+import os
+
+AZURE_BACKEND = "azure"
+ONNX_BACKEND = "onnx"
+
+
+def get_embedding_backend(db_index: str) -> str:
+    # e.g. K8SINDEX_EMBEDDING_BACKEND=onnx, otherwise EMBEDDING_BACKEND, otherwise azure
+    return os.getenv(f"{db_index.upper()}_EMBEDDING_BACKEND") or os.getenv('EMBEDDING_BACKEND') or AZURE_BACKEND
+
+
+def create_embeddings(backend: str = AZURE_BACKEND):
+
+    if backend == ONNX_BACKEND:
+        from embedding.onnx_embeddings import OnnxEmbeddings
+
+        model_path = os.getenv('ONNX_EMBEDDING_MODEL_PATH')
+        if not model_path:
+            raise ValueError("ONNX_EMBEDDING_MODEL_PATH must be set to use the onnx embedding backend")
+        return CachedQueryEmbeddings(
+            OnnxEmbeddings(model_path),
+            model_key = f"onnx:{os.path.basename(os.path.normpath(model_path))}:{os.path.getsize(os.path.join(model_path, 'model.onnx'))}",
+        )
+
+    if backend == AZURE_BACKEND:
+        return CachedQueryEmbeddings(
+            AzureOpenAIEmbeddings(
+                api_key          = os.getenv('AZURE_API_KEY_GPT4'),
+                api_version      = os.getenv('AZURE_EMBEDDING_VERSION'),
+                azure_deployment = os.getenv('AZURE_EMBEDDING_MODEL'),
+                azure_endpoint   = os.getenv('AZURE_ENDPOINT'),
+            ),
+            model_key = f"azure:{os.getenv('AZURE_EMBEDDING_MODEL')}:{os.getenv('AZURE_EMBEDDING_VERSION')}",
+        )
+
+    raise ValueError(f"Unknown embedding backend: {backend}")
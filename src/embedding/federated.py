@@ -0,0 +1,186 @@
+import asyncio
+import time
+from concurrent.futures import TimeoutError, wait
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from embedding.diversity import within_budget
+from embedding.reranker import getReranker, RERANK_TIME_BUDGET
+from embedding.result_cache import getRetrievalResultCache
+from embedding.retriever import (
+    DEFAULT_TOKEN_BUDGET, VECTOR_SEARCH_COOLDOWN, VECTOR_SEARCH_TIMEOUT, async_search_executor, reciprocal_rank_fusion,
+    search_executor,
+)
+
+FEDERATED_COLLECTION = "federated"
+
+
+class FederatedRetriever(BaseRetriever):
+    """
+    Searches several collections at once, each through its own SmeRetriever (see ChromaSme.getRetriever),
+    and returns a single ranking.
+
+    The query is embedded once per embedding backend and every retriever runs its whole search with it
+    concurrently: hybrid fusion, section routing, rerank, MMR and merge, compact index or snapshot and
+    expansion, as configured on the retriever. The results are fused by rank, each collection weighted by
+    the best cosine similarity of its chunks to the query, so that a collection unrelated to the query
+    does not place its least bad chunk next to the real answers. With rerank=True the fused documents are
+    reordered by the cross-encoder, whose scores are comparable between collections.
+    When the embedding is too slow or failing, every collection runs its lexical search alone.
+    """
+
+    retrievers: List[Any]
+    k: int = 5
+    vector_timeout: float = VECTOR_SEARCH_TIMEOUT
+    vector_down_until: float = 0
+    token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET
+    rerank: bool = False
+    rerank_candidates: int = 30
+    rerank_budget: float = RERANK_TIME_BUDGET
+    cache: bool = True
+
+    class Config:
+        arbitrary_types_allowed = True
+
+# ================================================
+    def backends(self) -> dict:
+        """One collection per embedding backend: its embedding of the query is shared by the others."""
+        return {retriever.sme.embedding_backend: retriever.sme for retriever in reversed(self.retrievers)}
+
+    def collection_search(self, retriever, query: str, embedding) -> tuple:
+        """Returns the documents of one collection, whether its search was complete and its relevance."""
+        try:
+            if embedding is None:
+                documents, _ = retriever.search(query, dense=False)
+                return documents, False, 1.0
+            distances = {}
+            documents, complete = retriever.search(query, embedding, distances=distances)
+        except Exception as e:
+            print(f"[{retriever.sme.collection_name}] federated search failed ({e}), skipping the collection")
+            return [], False, 0.0
+        # the best dense hit of the search: chroma's squared L2 distance between normalized vectors, 2 - 2 * cosine
+        relevance = max(1 - min(distances.values()) / 2, 0.0) if distances else 0.0
+        return documents, complete, relevance
+
+    def merge(self, query: str, results: list) -> tuple:
+        """Fuses the results of the collections, returns the documents and whether the rerank (if any) succeeded."""
+        documents, rankings, weights = {}, [], []
+        for retriever, (found, _, relevance) in zip(self.retrievers, results):
+            collection = retriever.sme.collection_name
+            for position, document in enumerate(found):
+                documents[f"{collection}:{position}"] = Document(page_content=document.page_content, metadata={**document.metadata, "collection": collection})
+            rankings.append([f"{collection}:{position}" for position in range(len(found))])
+            weights.append(relevance)
+        ranked = [documents[key] for key, _ in reciprocal_rank_fusion(rankings, weights=weights)]
+
+        reranked = True
+        reranker = getReranker() if self.rerank else None
+        if reranker is not None and ranked:
+            candidates = ranked[:self.rerank_candidates]
+            try:
+                scores = reranker.score(query, [document.page_content for document in candidates], self.rerank_budget)
+            except Exception as e:
+                print(f"[{FEDERATED_COLLECTION}] rerank failed ({e}), keeping the merged order")
+                scores = None
+            reranked = scores is not None
+            if reranked:
+                ranked = [candidates[i] for i in np.argsort(-scores, kind="stable")]
+
+        ranked = ranked[:self.k]
+        return (within_budget(ranked, self.token_budget) if self.token_budget else ranked), reranked
+
+    def mark_vector_down(self, reason: str):
+        print(f"[{FEDERATED_COLLECTION}] query embedding {reason}, using lexical results")
+        self.vector_down_until = time.monotonic() + VECTOR_SEARCH_COOLDOWN
+
+    def complete(self, embeddings: dict, results: list, reranked: bool) -> bool:
+        # degraded results (lexical only, failed collection or rerank) are not cached
+        return len(embeddings) == len(self.backends()) and all(complete for _, complete, _ in results) and reranked
+
+# ================================================
+    def search(self, query: str) -> tuple:
+        embeddings = {}
+        if time.monotonic() >= self.vector_down_until:
+            futures = {backend: search_executor.submit(sme.embedQuery, query) for backend, sme in self.backends().items()}
+            wait(futures.values(), timeout=self.vector_timeout)
+            for backend, future in futures.items():
+                try:
+                    embeddings[backend] = future.result(timeout=0)
+                except TimeoutError:
+                    self.mark_vector_down(f"slower than {self.vector_timeout}s")
+                except Exception as e:
+                    self.mark_vector_down(f"failed ({e})")
+
+        futures = [
+            search_executor.submit(self.collection_search, retriever, query, embeddings.get(retriever.sme.embedding_backend))
+            for retriever in self.retrievers
+        ]
+        results = [future.result() for future in futures]
+        documents, reranked = self.merge(query, results)
+        return documents, self.complete(embeddings, results, reranked)
+
+    async def asearch(self, query: str) -> tuple:
+        embeddings = {}
+        if time.monotonic() >= self.vector_down_until:
+            backends = self.backends()
+            results = await asyncio.gather(*[
+                asyncio.wait_for(sme.aembedQuery(query), timeout=self.vector_timeout) for sme in backends.values()
+            ], return_exceptions=True)
+            for backend, result in zip(backends, results):
+                if isinstance(result, asyncio.TimeoutError):
+                    self.mark_vector_down(f"slower than {self.vector_timeout}s")
+                elif isinstance(result, BaseException):
+                    self.mark_vector_down(f"failed ({result})")
+                else:
+                    embeddings[backend] = result
+
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(async_search_executor, self.collection_search, retriever, query, embeddings.get(retriever.sme.embedding_backend))
+            for retriever in self.retrievers
+        ])
+        documents, reranked = await loop.run_in_executor(async_search_executor, self.merge, query, results)
+        return documents, self.complete(embeddings, results, reranked)
+
+# ================================================
+    def options(self) -> dict:
+        return {
+            "collections": {retriever.sme.collection_name: retriever.options() for retriever in self.retrievers},
+            "k": self.k, "token_budget": self.token_budget, "rerank": self.rerank,
+            "rerank_candidates": self.rerank_candidates, "rerank_budget": self.rerank_budget,
+        }
+
+    def version(self) -> str:
+        smes = sorted((retriever.sme for retriever in self.retrievers), key=lambda sme: sme.collection_name)
+        return ",".join(f"{sme.collection_name}={sme.getVersion()}" for sme in smes)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if not self.cache:
+            return self.search(query)[0]
+
+        cache = getRetrievalResultCache()
+        version, key = self.version(), cache.key(query, self.options())
+        documents = cache.get(FEDERATED_COLLECTION, version, key)
+        if documents is None:
+            documents, complete = self.search(query)
+            if complete:
+                cache.put(FEDERATED_COLLECTION, version, key, documents)
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if not self.cache:
+            return (await self.asearch(query))[0]
+
+        loop = asyncio.get_running_loop()
+        cache = getRetrievalResultCache()
+        # reading the versions can open snapshots or stat files, never on the event loop
+        version, key = await loop.run_in_executor(async_search_executor, self.version), cache.key(query, self.options())
+        documents = await loop.run_in_executor(async_search_executor, cache.get, FEDERATED_COLLECTION, version, key)
+        if documents is None:
+            documents, complete = await self.asearch(query)
+            if complete:
+                await loop.run_in_executor(async_search_executor, cache.put, FEDERATED_COLLECTION, version, key, documents)
+        return documents
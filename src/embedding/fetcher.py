@@ -0,0 +1,157 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 16))
+FETCH_RATE_PER_HOST = float(os.getenv('FETCH_RATE_PER_HOST', 10))
+FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', 4))
+FETCH_TIMEOUT = 30
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchResult:
+
+    def __init__(self, url: str, status: int = None, text: str = None, etag: str = None, last_modified: str = None, error: str = None):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.error = error
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and (self.status == 304 or 200 <= self.status < 300)
+
+
+class HostRateLimiter:
+    """Spaces the requests to one host at least 1 / rate seconds apart, across all the fetching threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def retry_after_seconds(response) -> float:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class PageFetcher:
+    """
+    Downloads pages concurrently over a pooled keep-alive session.
+
+    Requests to the same host are rate limited (rate_per_host per second), failed requests (connection
+    errors, 429 and 5xx) are retried with exponential backoff and full jitter, honoring Retry-After.
+    With the ETag / Last-Modified of a previous download the request is conditional and an unchanged
+    page comes back as a 304 without a body.
+    """
+
+    def __init__(self, concurrency: int = FETCH_CONCURRENCY, rate_per_host: float = FETCH_RATE_PER_HOST,
+                 retries: int = FETCH_RETRIES, timeout: float = FETCH_TIMEOUT):
+        self.concurrency = concurrency
+        self.rate_per_host = rate_per_host
+        self.retries = retries
+        self.timeout = timeout
+        self.limiters = {}
+        self.limiters_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = os.getenv('USER_AGENT', "clustervigil-ingestion")
+
+# ================================================
+    def __limiter(self, url: str) -> HostRateLimiter:
+        host = urlparse(url).netloc
+        with self.limiters_lock:
+            if host not in self.limiters:
+                self.limiters[host] = HostRateLimiter(self.rate_per_host)
+            return self.limiters[host]
+
+    def __backoff(self, attempt: int, retry_after: float = None):
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        time.sleep(max(delay, retry_after or 0))
+
+    def fetch(self, url: str, etag: str = None, last_modified: str = None) -> FetchResult:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        error = None
+        for attempt in range(self.retries + 1):
+            self.__limiter(url).acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = repr(e)
+                if attempt < self.retries:
+                    self.__backoff(attempt)
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                error = f"HTTP {response.status_code}"
+                self.__backoff(attempt, retry_after_seconds(response))
+                continue
+            if response.status_code >= 400:
+                return FetchResult(url, status=response.status_code, error=f"HTTP {response.status_code}")
+            return FetchResult(
+                url,
+                status        = response.status_code,
+                text          = response.text if response.status_code != 304 else None,
+                etag          = response.headers.get("ETag") or etag,
+                last_modified = response.headers.get("Last-Modified") or last_modified,
+            )
+        return FetchResult(url, error=error)
+
+    def fetch_all(self, urls, validators: dict = None):
+        """
+        Yields a FetchResult per url as soon as it is downloaded (completion order); validators maps
+        an url to its previous (etag, last_modified). At most 2 * concurrency requests are pending.
+        """
+        validators = validators or {}
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="fetcher") as executor:
+            pending = set()
+            while True:
+                for url in urls:
+                    pending.add(executor.submit(self.fetch, url, *validators.get(url, (None, None))))
+                    if len(pending) >= 2 * self.concurrency:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+MANIFEST_FILE = "ingestion_manifest.sqlite"
+CHECKPOINT_PAGES = int(os.getenv('INGEST_CHECKPOINT_PAGES', 50))
+
+
+class IngestionManifest:
+    """
+    What was ingested from every page of a collection: sitemap lastmod, hash of the parsed content
+    and number of chunks. Incremental runs compare against it to only re-embed what changed.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(os.getenv('VECTORIAL_DB_PATH') or ".", MANIFEST_FILE)
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    collection    TEXT,
+                    url           TEXT,
+                    lastmod       TEXT,
+                    content_hash  TEXT,
+                    chunks        INTEGER,
+                    updated_at    REAL,
+                    etag          TEXT,
+                    last_modified TEXT,
+                    PRIMARY KEY (collection, url)
+                )
+            """)
+            # manifests written before the HTTP validators were stored
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(pages)")}
+            for column in ("etag", "last_modified"):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE pages ADD COLUMN {column} TEXT")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    collection  TEXT PRIMARY KEY,
+                    run         TEXT,
+                    started_at  REAL,
+                    finished_at REAL
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    collection TEXT,
+                    source     TEXT,
+                    run        TEXT,
+                    chunk_ids  TEXT,
+                    stored_at  REAL,
+                    PRIMARY KEY (collection, source)
+                )
+            """)
+
+# ================================================
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections can not be shared between threads
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = self.local.connection = sqlite3.connect(self.path, timeout=30)
+        return connection
+
+    def pages(self, collection: str) -> dict:
+        """{url: {"lastmod", "content_hash", "chunks", "etag", "last_modified"}} of the collection."""
+        rows = self.connection().execute(
+            "SELECT url, lastmod, content_hash, chunks, etag, last_modified FROM pages WHERE collection = ?", (collection,)
+        ).fetchall()
+        return {
+            url: {"lastmod": lastmod, "content_hash": content_hash, "chunks": chunks, "etag": etag, "last_modified": last_modified}
+            for url, lastmod, content_hash, chunks, etag, last_modified in rows
+        }
+
+    def put(self, collection: str, url: str, lastmod: str, content_hash: str, chunks: int, etag: str = None, last_modified: str = None):
+        # the HTTP validators are only stored with the content they describe, once it is in the collection
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO pages (collection, url, lastmod, content_hash, chunks, updated_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection, url, lastmod, content_hash, chunks, time.time(), etag, last_modified),
+            )
+
+    def delete(self, collection: str, url: str):
+        with self.connection() as connection:
+            connection.execute("DELETE FROM pages WHERE collection = ? AND url = ?", (collection, url))
+
+# ================================================
+    def start_run(self, collection: str, resume: bool = False) -> tuple:
+        """(run, checkpointed sources): the last run of the collection if resume and it did not finish, otherwise a new one."""
+        with self.connection() as connection:
+            row = connection.execute("SELECT run, finished_at FROM runs WHERE collection = ?", (collection,)).fetchone()
+            if resume and row is not None and row[1] is None:
+                rows = connection.execute("SELECT source FROM checkpoints WHERE collection = ? AND run = ?", (collection, row[0])).fetchall()
+                return row[0], {source for source, in rows}
+            run = uuid.uuid4().hex
+            connection.execute("DELETE FROM checkpoints WHERE collection = ?", (collection,))
+            connection.execute("INSERT OR REPLACE INTO runs (collection, run, started_at, finished_at) VALUES (?, ?, ?, NULL)", (collection, run, time.time()))
+            return run, set()
+
+    def checkpoint(self, collection: str, run: str, pages: list):
+        """Records [(source, chunk ids)] whose chunks are all stored, in a single transaction."""
+        now = time.time()
+        with self.connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO checkpoints (collection, source, run, chunk_ids, stored_at) VALUES (?, ?, ?, ?, ?)",
+                [(collection, source, run, " ".join(chunk_ids), now) for source, chunk_ids in pages],
+            )
+
+    def finish_run(self, collection: str, run: str):
+        with self.connection() as connection:
+            connection.execute("UPDATE runs SET finished_at = ? WHERE collection = ? AND run = ?", (time.time(), collection, run))
+
+
+class IngestionCheckpoint:
+    """
+    Durable progress of a full ingestion run: the sources whose chunks are all stored and the ids of those
+    chunks (a copy of another chunk is stored under the id of the original), committed every `every` pages.
+    With resume the last unfinished run of the collection continues and done holds what it already stored.
+    """
+
+    def __init__(self, collection: str, resume: bool = False, manifest: IngestionManifest = None, every: int = CHECKPOINT_PAGES):
+        self.collection = collection
+        self.manifest = manifest or IngestionManifest()
+        self.every = every
+        self.pending = []
+        self.lock = threading.Lock()
+        self.run, self.done = self.manifest.start_run(collection, resume)
+        self.chunks = 0
+        if resume:
+            print(f"[{collection}] resuming run {self.run}: {len(self.done)} sources already stored" if self.done else f"[{collection}] nothing to resume, starting a new run")
+
+    def add(self, source: str, chunk_ids: list):
+        with self.lock:
+            self.pending.append((source, chunk_ids))
+            if len(self.pending) < self.every:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pages, self.pending = self.pending, []
+            if not pages:
+                return
+            self.manifest.checkpoint(self.collection, self.run, pages)
+            self.done.update(source for source, _ in pages)
+            self.chunks += sum(len(chunk_ids) for _, chunk_ids in pages)
+            print(f"[{self.collection}] checkpoint: {len(self.done)} sources done, {self.chunks} chunks stored since start")
+
+    def finish(self):
+        self.flush()
+        self.manifest.finish_run(self.collection, self.run)
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import numpy as np
+import onnxruntime
+from langchain_core.embeddings import Embeddings
+from tokenizers import Tokenizer
+
+BATCH_SIZE = 32
+MAX_TOKENS = 256
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings computed locally on CPU with an exported transformer model
+    (e.g. all-MiniLM-L6-v2): the directory must contain model.onnx and tokenizer.json.
+    Batches are sorted by length to limit padding and run in parallel on a thread pool.
+    """
+
+    def __init__(self, model_path: str, batch_size: int = BATCH_SIZE, workers: int = None, max_tokens: int = MAX_TOKENS):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 1) // 2))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        # the parallelism comes from the batches running concurrently, split the cores between them
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.session = onnxruntime.InferenceSession(os.path.join(model_path, "model.onnx"), options, providers=["CPUExecutionProvider"])
+        self.input_names = {input.name for input in self.session.get_inputs()}
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="onnx-embeddings")
+
+# ================================================
+    def __embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids":      np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        output = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+
+        if output.ndim == 3:
+            # mean pooling of the token embeddings, ignoring the padding
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return output / np.clip(np.linalg.norm(output, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        results = self.executor.map(lambda batch: self.__embed_batch([texts[i] for i in batch]), batches)
+
+        vectors = [None] * len(texts)
+        for batch, embeddings in zip(batches, results):
+            for i, embedding in zip(batch, embeddings):
+                vectors[i] = embedding.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.__embed_batch([text])[0].tolist()
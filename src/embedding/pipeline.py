@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+
+QUEUE_SIZE = 64
+POLL_SECONDS = 0.1
+
+STOP = object()
+
+
+class Batcher:
+    """
+    Groups the items flowing through a stage into lists of at most size items, the last one at flush.
+    With weight(item) a list is also closed before its total weight would exceed max_weight.
+    """
+
+    def __init__(self, size: int, max_weight: int = None, weight=None):
+        self.size = size
+        self.max_weight = max_weight
+        self.weight = weight
+        self.batch = []
+        self.batch_weight = 0
+
+    def __take(self) -> list:
+        batch, self.batch, self.batch_weight = self.batch, [], 0
+        return batch
+
+    def __call__(self, item):
+        weight = self.weight(item) if self.weight else 0
+        batches = []
+        if self.batch and self.max_weight and self.batch_weight + weight > self.max_weight:
+            batches.append(self.__take())
+        self.batch.append(item)
+        self.batch_weight += weight
+        if len(self.batch) >= self.size:
+            batches.append(self.__take())
+        return batches
+
+    def flush(self):
+        return [self.__take()] if self.batch else []
+
+
+class Pipeline:
+    """
+    Streams items through stages connected by bounded queues, each stage with its own worker threads.
+
+    stages is a list of (name, function, workers): function(item) returns the items for the next stage
+    (an iterable, None for nothing). A stage with a flush() method (e.g. Batcher, which must run with
+    a single worker) emits what it still holds once its input is over. A full queue blocks the stage
+    in front of it, so memory stays bounded whatever the size of the source. The first error stops
+    every stage and is raised by run().
+    """
+
+    def __init__(self, stages: list, queue_size: int = QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.counts = {name: 0 for name, _, _ in stages}
+        self.counts_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.error = None
+
+# ================================================
+    def __put(self, target: queue.Queue, item) -> bool:
+        while not self.stopping.is_set():
+            try:
+                target.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __get(self, source: queue.Queue):
+        while not self.stopping.is_set():
+            try:
+                return source.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return STOP
+
+    def __fail(self, error: Exception):
+        if self.error is None:
+            self.error = error
+        self.stopping.set()
+
+# ================================================
+    def __feed(self, source, target: queue.Queue, workers: int):
+        try:
+            for item in source:
+                if not self.__put(target, item):
+                    return
+        except Exception as e:
+            self.__fail(e)
+            return
+        for _ in range(workers):
+            self.__put(target, STOP)
+
+    def __work(self, index: int, source: queue.Queue, target: queue.Queue, remaining: list, lock: threading.Lock):
+        name, function, _ = self.stages[index]
+        while True:
+            item = self.__get(source)
+            if item is STOP:
+                break
+            try:
+                for output in function(item) or ():
+                    if target is not None and not self.__put(target, output):
+                        return
+            except Exception as e:
+                self.__fail(e)
+                return
+            with self.counts_lock:
+                self.counts[name] += 1
+
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if not last or self.stopping.is_set():
+            return
+        try:
+            for output in getattr(function, "flush", lambda: ())():
+                if target is not None:
+                    self.__put(target, output)
+        except Exception as e:
+            self.__fail(e)
+            return
+        if target is not None:
+            for _ in range(self.stages[index + 1][2]):
+                self.__put(target, STOP)
+
+    def run(self, source) -> dict:
+        """Consumes the source through all the stages, returns the items processed per stage and the seconds taken."""
+        start = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self.__feed, args=(source, queues[0], self.stages[0][2]), name="pipeline-source", daemon=True)]
+        for index, (name, _, workers) in enumerate(self.stages):
+            target = queues[index + 1] if index + 1 < len(self.stages) else None
+            remaining, lock = [workers], threading.Lock()
+            threads.extend(
+                threading.Thread(target=self.__work, args=(index, queues[index], target, remaining, lock), name=f"pipeline-{name}", daemon=True)
+                for _ in range(workers)
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        return {**self.counts, "seconds": round(time.perf_counter() - start, 3)}
@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+ROW_BLOCK = 8192
+PQ_CENTROIDS = 256
+PQ_SUB_DIMENSIONS = 8
+PQ_ITERATIONS = 10
+PQ_TRAINING_SAMPLE = 20000
+EXPORT_BATCH = 5000
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12, None)
+
+
+def kmeans(points: np.ndarray, clusters: int, iterations: int, rng) -> np.ndarray:
+    centroids = points[rng.choice(len(points), size=min(clusters, len(points)), replace=False)].copy()
+    for _ in range(iterations):
+        distances = (points ** 2).sum(1)[:, None] - 2 * points @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        assignment = distances.argmin(1)
+        for cluster in range(len(centroids)):
+            members = points[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(0)
+    return centroids
+
+
+class QuantizedIndex:
+    """
+    Compact first-pass index of the vectors of a collection.
+
+    The vectors are kept in memory quantized (int8 per dimension, or product quantization with one
+    byte per sub-vector of PQ_SUB_DIMENSIONS). The index holds no copy of the full float32 vectors:
+    the best candidates are re-scored exactly with the vectors the collection already stores
+    (search(embeddings=sme.getEmbeddings), read from the mapped snapshot when serving from one).
+
+    Build and evaluate it from src/:
+        python -m embedding.quantized_index build --collection k8sindex --method int8
+        python -m embedding.quantized_index evaluate --collection k8sindex --k 5
+    """
+
+    def __init__(self, ids: list, codes: np.ndarray, method: str, scales: np.ndarray = None,
+                 centroids: np.ndarray = None, version: str = None):
+        self.ids = ids
+        self.codes = codes
+        self.method = method
+        self.scales = scales
+        self.centroids = centroids
+        # collection version the index was built from, a stale index would miss the new chunks
+        self.version = version
+
+# ================================================
+    @classmethod
+    def build(cls, ids: list, vectors: np.ndarray, method: str = "int8", seed: int = 0) -> "QuantizedIndex":
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+
+        if method == "int8":
+            scales = np.clip(np.abs(vectors).max(axis=0), 1e-12, None) / 127
+            codes = np.round(vectors / scales).astype(np.int8)
+            return cls(ids, codes, method, scales=scales.astype(np.float32))
+
+        if method == "pq":
+            dimensions = vectors.shape[1]
+            if dimensions % PQ_SUB_DIMENSIONS:
+                raise ValueError(f"Vector size {dimensions} is not a multiple of {PQ_SUB_DIMENSIONS}")
+            rng = np.random.default_rng(seed)
+            sample = vectors[rng.choice(len(vectors), size=min(PQ_TRAINING_SAMPLE, len(vectors)), replace=False)]
+
+            subspaces = dimensions // PQ_SUB_DIMENSIONS
+            centroids = np.zeros((subspaces, PQ_CENTROIDS, PQ_SUB_DIMENSIONS), dtype=np.float32)
+            codes = np.zeros((len(vectors), subspaces), dtype=np.uint8)
+            for subspace in range(subspaces):
+                columns = slice(subspace * PQ_SUB_DIMENSIONS, (subspace + 1) * PQ_SUB_DIMENSIONS)
+                trained = kmeans(sample[:, columns], PQ_CENTROIDS, PQ_ITERATIONS, rng)
+                centroids[subspace, :len(trained)] = trained
+                for start in range(0, len(vectors), ROW_BLOCK):
+                    block = vectors[start:start + ROW_BLOCK, columns]
+                    distances = (block ** 2).sum(1)[:, None] - 2 * block @ trained.T + (trained ** 2).sum(1)[None, :]
+                    codes[start:start + ROW_BLOCK, subspace] = distances.argmin(1)
+            return cls(ids, codes, method, centroids=centroids)
+
+        raise ValueError(f"Unknown quantization method: {method}")
+
+    @property
+    def dimensions(self) -> int:
+        return self.codes.shape[1] if self.method == "int8" else self.codes.shape[1] * PQ_SUB_DIMENSIONS
+
+# ================================================
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "codes.npy"), self.codes)
+        # written by indexes that kept their own copy of the full vectors
+        if os.path.exists(os.path.join(directory, "vectors.npy")):
+            os.remove(os.path.join(directory, "vectors.npy"))
+        if self.scales is not None:
+            np.save(os.path.join(directory, "scales.npy"), self.scales)
+        if self.centroids is not None:
+            np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        with open(os.path.join(directory, "ids.json"), 'w') as file:
+            json.dump(self.ids, file)
+        with open(os.path.join(directory, "meta.json"), 'w') as file:
+            json.dump({
+                "method":     self.method,
+                "count":      len(self.ids),
+                "dimensions": self.dimensions,
+                "version":    self.version,
+            }, file)
+
+    @classmethod
+    def load(cls, directory: str) -> "QuantizedIndex":
+        with open(os.path.join(directory, "meta.json"), 'r') as file:
+            meta = json.load(file)
+        with open(os.path.join(directory, "ids.json"), 'r') as file:
+            ids = json.load(file)
+
+        def optional(name):
+            path = os.path.join(directory, name)
+            return np.load(path) if os.path.exists(path) else None
+
+        return cls(
+            ids,
+            np.load(os.path.join(directory, "codes.npy")),
+            meta["method"],
+            scales    = optional("scales.npy"),
+            centroids = optional("centroids.npy"),
+            version   = meta.get("version"),
+        )
+
+# ================================================
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        if self.method == "int8":
+            weights = (query * self.scales).astype(np.float32)
+            for start in range(0, len(self.codes), ROW_BLOCK):
+                scores[start:start + ROW_BLOCK] = self.codes[start:start + ROW_BLOCK].astype(np.float32) @ weights
+        else:
+            subspaces = self.centroids.shape[0]
+            table = np.einsum("sd,scd->sc", query.reshape(subspaces, -1), self.centroids)
+            rows = np.arange(subspaces)
+            for start in range(0, len(self.codes), ROW_BLOCK):
+                scores[start:start + ROW_BLOCK] = table[rows, self.codes[start:start + ROW_BLOCK]].sum(1)
+        return scores
+
+    def search(self, query, k: int = 5, embeddings=None, candidates: int = None) -> list:
+        """
+        Returns [(id, cosine similarity)]. With embeddings(ids) -> {id: full vector} (e.g. sme.getEmbeddings)
+        the best candidates are re-scored exactly, otherwise the approximate scores are returned.
+        """
+        query = normalize(np.asarray(query, dtype=np.float32))
+        scores = self.approximate_scores(query)
+
+        candidates = min(len(scores), max(k, candidates or k * 10) if embeddings else k)
+        if candidates == 0:
+            return []
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        if embeddings:
+            vectors = embeddings([self.ids[row] for row in best])
+            rows = [row for row in best if self.ids[row] in vectors]
+            if not rows:
+                return []
+            exact = normalize(np.asarray([vectors[self.ids[row]] for row in rows], dtype=np.float32)) @ query
+            scores = dict(zip(rows, exact))
+            best = sorted(rows, key=lambda row: scores[row], reverse=True)[:k]
+        else:
+            scores = dict(zip(best, scores[best]))
+            best = sorted(best, key=lambda row: scores[row], reverse=True)[:k]
+        return [(self.ids[row], float(scores[row])) for row in best]
+
+# ================================================
+    def memory_report(self) -> dict:
+        full = len(self.ids) * self.dimensions * 4
+        compact = self.codes.nbytes + sum(array.nbytes for array in (self.scales, self.centroids) if array is not None)
+        return {"vectors": len(self.ids), "full_bytes": full, "compact_bytes": compact, "ratio": full / compact if compact else 0}
+
+    def evaluate(self, vectors: np.ndarray, queries: np.ndarray, k: int = 5, rescore: bool = True, candidates: int = None) -> dict:
+        """Recall@k against the exact search on the full vectors (rows in the order of ids) and latency of both, on the given query vectors."""
+        full = normalize(np.asarray(vectors, dtype=np.float32))
+        rows = {id: row for row, id in enumerate(self.ids)}
+        embeddings = (lambda ids: {id: full[rows[id]] for id in ids}) if rescore else None
+        recalls, exact_latency, compact_latency = [], [], []
+        for query in normalize(np.asarray(queries, dtype=np.float32)):
+            start = time.perf_counter()
+            exact = set(self.ids[row] for row in np.argsort(-(full @ query))[:k])
+            exact_latency.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            found = set(id for id, _ in self.search(query, k=k, embeddings=embeddings, candidates=candidates))
+            compact_latency.append(time.perf_counter() - start)
+            recalls.append(len(exact & found) / k)
+
+        return {
+            "recall_at_k":     float(np.mean(recalls)),
+            "exact_p50_ms":    float(np.percentile(exact_latency, 50) * 1000),
+            "compact_p50_ms":  float(np.percentile(compact_latency, 50) * 1000),
+            "compact_p95_ms":  float(np.percentile(compact_latency, 95) * 1000),
+            **self.memory_report(),
+        }
+
+
+def compact_index_path(collection: str) -> str:
+    return os.path.join(os.getenv('VECTORIAL_DB_PATH') or ".", "compact", collection)
+
+
+class CompactIndexLoader:
+    """
+    Loads the compact index of a collection for the version being served (of the collection or of its snapshot).
+    A missing or stale index is only read again once the version or the index file changed.
+    """
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self.index = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def get(self, version: str):
+        """The index built from this version, None if it was not built or is older."""
+        with self.lock:
+            if self.index is None or self.index.version != version:
+                path = compact_index_path(self.collection)
+                try:
+                    modified = os.path.getmtime(os.path.join(path, "meta.json"))
+                except FileNotFoundError:
+                    modified = None
+                if self.checked != (version, modified):
+                    self.checked = (version, modified)
+                    try:
+                        self.index = QuantizedIndex.load(path)
+                    except FileNotFoundError:
+                        self.index = None
+            if self.index is None or self.index.version != version:
+                return None
+            return self.index
+
+
+def export_vectors(sme) -> tuple:
+    ids, vectors = [], []
+    collection = sme.getDb()._collection
+    total = collection.count()
+    for offset in range(0, total, EXPORT_BATCH):
+        result = collection.get(limit=EXPORT_BATCH, offset=offset, include=["embeddings"])
+        ids.extend(result["ids"])
+        vectors.extend(result["embeddings"])
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build and evaluate the compact quantized index of a collection")
+    parser.add_argument("command", choices=["build", "evaluate"])
+    parser.add_argument("--collection", required=True, help="Chroma collection name (e.g. k8sindex)")
+    parser.add_argument("--method", choices=["int8", "pq"], default="int8", help="Quantization method (default: int8)")
+    parser.add_argument("--k", type=int, default=5, help="Number of results used for recall@k (default: 5)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of stored vectors used as queries (default: 200)")
+    parser.add_argument("--candidates", type=int, help="Candidates re-scored with the full vectors (default: 10 * k)")
+    parser.add_argument("--no-rescore", action="store_true", help="Evaluate the first pass only")
+    return parser.parse_args()
+
+
+def main():
+    from dotenv import load_dotenv
+    from embedding.chroma import ChromaSme
+    load_dotenv(override=True)
+    args = parse_args()
+
+    if args.command == "build":
+        index = ChromaSme(args.collection).buildCompactIndex(args.method)
+        print(json.dumps(index.memory_report(), indent=2))
+        return
+
+    index = QuantizedIndex.load(compact_index_path(args.collection))
+    ids, vectors = export_vectors(ChromaSme(args.collection))
+    rows = {id: row for row, id in enumerate(ids)}
+    vectors = vectors[[rows[id] for id in index.ids]]
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(index.ids), size=min(args.queries, len(index.ids)), replace=False)
+    # stored vectors with some noise stand in for real queries
+    queries = vectors[np.sort(sample)] + rng.normal(scale=0.01, size=(len(sample), vectors.shape[1]))
+    print(json.dumps(index.evaluate(vectors, queries, k=args.k, rescore=not args.no_rescore, candidates=args.candidates), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import onnxruntime
+from tokenizers import Tokenizer
+
+BATCH_SIZE = 16
+MAX_TOKENS = 512
+RERANK_TIME_BUDGET = float(os.getenv('RERANK_TIME_BUDGET', 1.0))
+
+
+class OnnxCrossEncoder:
+    """
+    Scores (query, passage) pairs with an exported cross-encoder (e.g. ms-marco-MiniLM-L-6-v2):
+    the directory must contain model.onnx and tokenizer.json. Batches run in parallel on CPU.
+    """
+
+    def __init__(self, model_path: str, batch_size: int = BATCH_SIZE, workers: int = None, max_tokens: int = MAX_TOKENS):
+        self.batch_size = batch_size
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 1) // 2))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.session = onnxruntime.InferenceSession(os.path.join(model_path, "model.onnx"), options, providers=["CPUExecutionProvider"])
+        self.input_names = {input.name for input in self.session.get_inputs()}
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reranker")
+
+# ================================================
+    def __score_batch(self, query: str, passages: list, deadline: float) -> np.ndarray:
+        if time.monotonic() > deadline:
+            return None
+        encodings = self.tokenizer.encode_batch([(query, passage) for passage in passages])
+        inputs = {
+            "input_ids":      np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        # one logit per pair, or [not relevant, relevant]
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+    def score(self, query: str, passages: list, time_budget: float = RERANK_TIME_BUDGET):
+        """Relevance of every passage, None if the scoring did not complete within time_budget seconds."""
+        deadline = time.monotonic() + time_budget
+        futures = [
+            self.executor.submit(self.__score_batch, query, passages[i:i + self.batch_size], deadline)
+            for i in range(0, len(passages), self.batch_size)
+        ]
+        done, pending = wait(futures, timeout=time_budget)
+        for future in pending:
+            future.cancel()
+        if pending or any(future.result() is None for future in done):
+            return None
+        return np.concatenate([future.result() for future in futures]) if futures else np.array([])
+
+
+reranker = None
+reranker_lock = threading.Lock()
+
+
+def getReranker():
+    """The cross-encoder of the process, None when RERANKER_MODEL_PATH is not configured."""
+    global reranker
+    with reranker_lock:
+        if reranker is None and os.getenv('RERANKER_MODEL_PATH'):
+            reranker = OnnxCrossEncoder(os.getenv('RERANKER_MODEL_PATH'))
+        return reranker
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from langchain_core.documents import Document
+
+from embedding.embedding_cache import normalize_query
+
+MAX_MEMORY_BYTES = int(os.getenv('RETRIEVAL_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+class RetrievalResultCache:
+    """
+    Caches the documents returned for a query, keyed by collection, normalized query and retriever options.
+
+    Every key also contains the collection version stamp bumped by each ingestion run, so a reindex
+    makes the old entries unreachable: they are purged as soon as the new version is seen.
+    Memory is bounded by max_bytes (LRU); with spill_dir the evicted entries are kept on disk.
+    """
+
+    def __init__(self, max_bytes: int = MAX_MEMORY_BYTES, spill_dir: str = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or os.getenv('RETRIEVAL_CACHE_SPILL_DIR')
+        self.memory = OrderedDict()
+        self.used_bytes = 0
+        self.versions = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+# ================================================
+    def key(self, query: str, options: dict) -> str:
+        return hashlib.sha256(f"{normalize_query(query)}\n{json.dumps(options, sort_keys=True, default=str)}".encode()).hexdigest()
+
+    def __spill_path(self, collection: str, version: str, key: str = None) -> str:
+        path = os.path.join(self.spill_dir, collection, version)
+        return os.path.join(path, f"{key}.json") if key else path
+
+    def __check_version(self, collection: str, version: str):
+        known = self.versions.get(collection)
+        if known == version:
+            return
+        self.versions[collection] = version
+        if known is None:
+            # first use by this process: what earlier processes spilled for older versions goes
+            if self.spill_dir and os.path.isdir(os.path.join(self.spill_dir, collection)):
+                for stale in os.listdir(os.path.join(self.spill_dir, collection)):
+                    if stale != version:
+                        shutil.rmtree(self.__spill_path(collection, stale), ignore_errors=True)
+            return
+
+        for entry_key in [entry_key for entry_key in self.memory if entry_key[0] == collection]:
+            self.used_bytes -= self.memory.pop(entry_key)[1]
+        if self.spill_dir:
+            shutil.rmtree(self.__spill_path(collection, known), ignore_errors=True)
+
+# ================================================
+    def get(self, collection: str, version: str, key: str):
+        with self.lock:
+            self.__check_version(collection, version)
+            entry = self.memory.get((collection, version, key))
+            if entry is not None:
+                self.memory.move_to_end((collection, version, key))
+                self.hits += 1
+                return [Document(page_content=text, metadata=metadata) for text, metadata in entry[0]]
+
+        if self.spill_dir:
+            try:
+                with open(self.__spill_path(collection, version, key), 'r') as file:
+                    documents = json.load(file)
+                with self.lock:
+                    self.disk_hits += 1
+                    # back in memory: a hot entry is not read from disk at every lookup
+                    evicted = self.__remember(collection, version, key, [tuple(document) for document in documents])
+                self.__spill(evicted)
+                return [Document(page_content=text, metadata=metadata) for text, metadata in documents]
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, collection: str, version: str, key: str, documents: list):
+        entry = [(document.page_content, document.metadata) for document in documents]
+        with self.lock:
+            self.__check_version(collection, version)
+            evicted = self.__remember(collection, version, key, entry)
+        self.__spill(evicted)
+
+    def __remember(self, collection: str, version: str, key: str, entry: list) -> list:
+        """Adds the entry to the LRU (lock held), returns the entries evicted to make room."""
+        size = sum(len(text) + len(json.dumps(metadata, default=str)) for text, metadata in entry)
+        evicted = []
+        previous = self.memory.pop((collection, version, key), None)
+        if previous is not None:
+            self.used_bytes -= previous[1]
+        self.memory[(collection, version, key)] = (entry, size)
+        self.used_bytes += size
+        while self.used_bytes > self.max_bytes and len(self.memory) > 1:
+            evicted_key, (evicted_entry, evicted_size) = self.memory.popitem(last=False)
+            self.used_bytes -= evicted_size
+            evicted.append((evicted_key, evicted_entry))
+        return evicted
+
+    def __spill(self, evicted: list):
+        if self.spill_dir:
+            for (evicted_collection, evicted_version, evicted_key), evicted_entry in evicted:
+                path = self.__spill_path(evicted_collection, evicted_version, evicted_key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as file:
+                    json.dump(evicted_entry, file, default=str)
+
+# ================================================
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "lookups":      lookups,
+                "memory_hits":  self.hits,
+                "disk_hits":    self.disk_hits,
+                "misses":       self.misses,
+                "hit_rate":     (self.hits + self.disk_hits) / lookups if lookups else 0,
+                "entries":      len(self.memory),
+                "memory_bytes": self.used_bytes,
+            }
+
+
+retrieval_result_cache = None
+retrieval_result_cache_lock = threading.Lock()
+
+
+def getRetrievalResultCache() -> RetrievalResultCache:
+    """The cache shared by every retriever of the process."""
+    global retrieval_result_cache
+    with retrieval_result_cache_lock:
+        if retrieval_result_cache is None:
+            retrieval_result_cache = RetrievalResultCache()
+        return retrieval_result_cache
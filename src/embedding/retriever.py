@@ -0,0 +1,360 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import partial
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from embedding.chunks import chunk_id, join_chunks
+from embedding.diversity import estimate_tokens, mmr, merge_overlapping, within_budget
+from embedding.reranker import getReranker, RERANK_TIME_BUDGET
+from embedding.result_cache import getRetrievalResultCache
+from embedding.sections import route_sections, section_filter
+
+RRF_K = 60
+# weight of the unfiltered ranking fused with a routed one: a wrong route is corrected, a right one still wins
+UNROUTED_WEIGHT = 0.5
+VECTOR_SEARCH_TIMEOUT = float(os.getenv('VECTOR_SEARCH_TIMEOUT', 3))
+VECTOR_SEARCH_COOLDOWN = 60
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', 8))
+ASYNC_SEARCH_WORKERS = int(os.getenv('ASYNC_SEARCH_WORKERS', 4))
+DEFAULT_TOKEN_BUDGET = 1500
+DEFAULT_EXPAND_BUDGET = 1000
+
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="sme-search")
+# the blocking part of the async path (Chroma, BM25, reranker) runs here, never on the event loop
+async_search_executor = ThreadPoolExecutor(max_workers=ASYNC_SEARCH_WORKERS, thread_name_prefix="sme-async-search")
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K, weights: list = None) -> list:
+    """Fuses several lists of ids, ordered from the best, into a single [(id, score)] ranking."""
+    scores = {}
+    for ranking, weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0) + weight / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class SmeRetriever(BaseRetriever):
+    """
+    Retriever over a ChromaSme collection.
+
+    With hybrid=True the dense search runs alongside a local BM25 search over the same chunks
+    and the two rankings are fused with reciprocal rank fusion. When the embedding endpoint
+    is too slow (VECTOR_SEARCH_TIMEOUT) or failing, the lexical ranking alone is returned and
+    the dense search is skipped for a while.
+
+    With diverse=True the fetch_k candidates are reduced with MMR (near duplicates dropped),
+    overlapping chunks of the same page are merged and passages are returned until token_budget.
+
+    sections restricts the search to some sections of the docs (metadata pre-filter on the vector
+    side, per-section BM25 indexes fused by rank on the lexical side); with route=True the sections are
+    guessed from the query and the routed ranking is fused with a ranking of the whole collection at
+    UNROUTED_WEIGHT, so a wrong guess (generic words like "create" or "fix") still finds the answer.
+
+    With rerank=True a wider set of rerank_candidates is scored by the local cross-encoder and only
+    the best are kept; if the scoring does not fit in rerank_budget seconds the original order is used.
+
+    With compact=True the dense search runs on the quantized in-memory index of the collection
+    (see QuantizedIndex), re-scored with the stored vectors of the best candidates; sections filters
+    and a missing or stale index fall back to the vector search of the collection (or snapshot).
+
+    With expand="neighbors" every hit is lazily extended with the chunks around it in its page (up to
+    expand_window on each side, the following ones first), with expand="page" with the whole page when
+    it fits; at most expand_budget tokens are added, the best ranked hits are expanded first.
+
+    With cache=True the results are kept in the shared RetrievalResultCache, tied to the collection version.
+
+    The async path (ainvoke) embeds the query with the async client of the embedding model and runs
+    the rest of the search on async_search_executor; cancelling the caller cancels the embedding
+    request and drops the search if it has not started yet.
+    """
+
+    sme: Any
+    k: int = 5
+    hybrid: bool = True
+    fetch_k: int = 20
+    vector_timeout: float = VECTOR_SEARCH_TIMEOUT
+    vector_down_until: float = 0
+    diverse: bool = False
+    lambda_mult: float = 0.5
+    token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET
+    sections: Optional[List[str]] = None
+    route: bool = False
+    rerank: bool = False
+    rerank_candidates: int = 50
+    rerank_budget: float = RERANK_TIME_BUDGET
+    cache: bool = True
+    compact: bool = False
+    expand: Optional[str] = None
+    expand_window: int = 1
+    expand_budget: int = DEFAULT_EXPAND_BUDGET
+
+    class Config:
+        arbitrary_types_allowed = True
+
+# ================================================
+    def vector_search(self, query: str, k: int, sections=None) -> tuple:
+        embedding = self.sme.embedQuery(query)
+        return embedding, self.vector_hits(embedding, k, sections)
+
+    def vector_hits(self, embedding, k: int, sections=None) -> list:
+        index = self.sme.getCompactIndex() if self.compact and not sections else None
+        if index is None:
+            return self.sme.queryByVector(embedding, k=k, where=section_filter(sections))
+
+        hits = index.search(embedding, k=k, embeddings=self.sme.getEmbeddings)
+        documents = self.sme.getDocuments([id for id, _ in hits])
+        # same scale as the squared L2 distance chroma returns for normalized vectors
+        return [(id, documents[id], 2 - 2 * similarity) for id, similarity in hits if id in documents]
+
+    def lexical_search(self, query: str, k: int, sections=None) -> list:
+        if not sections:
+            return self.sme.getLexicalIndex().search(query, k=k)
+        # BM25 scores of different indexes are not on the same scale, only their ranks are merged
+        return reciprocal_rank_fusion([
+            [id for id, _ in self.sme.getLexicalIndex(section).search(query, k=k)] for section in sections
+        ])[:k]
+
+# ================================================
+    def rank(self, query: str, k: int, embedding=None, dense: bool = True, distances: dict = None) -> tuple:
+        """
+        Returns the query embedding (None if the dense search was skipped) and the best [(id, Document)].
+        A precomputed embedding is searched inline; dense=False searches the lexical index only.
+        distances, if given, receives {id: distance} of the dense hits.
+        """
+        if self.sections or not self.route:
+            return self.rank_in(query, k, self.sections, embedding, dense, distances)
+        sections = route_sections(query)
+        embedding, routed = self.rank_in(query, k, sections, embedding, dense, distances)
+        if not sections:
+            return embedding, routed
+
+        # the embedding of the routed pass is reused by the unfiltered one
+        embedding, everything = self.rank_in(query, k, None, embedding, dense and embedding is not None, distances)
+        documents = {id: document for id, document in routed + everything}
+        fused = reciprocal_rank_fusion([[id for id, _ in routed], [id for id, _ in everything]], weights=[1.0, UNROUTED_WEIGHT])
+        return embedding, [(id, documents[id]) for id, _ in fused[:k]]
+
+    def rank_in(self, query: str, k: int, sections, embedding=None, dense: bool = True, distances: dict = None) -> tuple:
+        if not self.hybrid:
+            if embedding is None:
+                embedding, hits = self.vector_search(query, k, sections)
+            else:
+                hits = self.vector_hits(embedding, k, sections)
+            if distances is not None:
+                distances.update((id, distance) for id, _, distance in hits)
+            return embedding, [(id, document) for id, document, _ in hits]
+
+        vector_hits = []
+        future = None
+        if embedding is not None:
+            vector_hits = self.vector_hits(embedding, max(k, self.fetch_k), sections)
+        elif dense and time.monotonic() >= self.vector_down_until:
+            future = search_executor.submit(self.vector_search, query, max(k, self.fetch_k), sections)
+
+        lexical_hits = self.lexical_search(query, max(k, self.fetch_k), sections)
+
+        if future is not None:
+            try:
+                embedding, vector_hits = future.result(timeout=self.vector_timeout)
+            except TimeoutError:
+                print(f"[{self.sme.collection_name}] vector search slower than {self.vector_timeout}s, using lexical results")
+                self.vector_down_until = time.monotonic() + VECTOR_SEARCH_COOLDOWN
+            except Exception as e:
+                print(f"[{self.sme.collection_name}] vector search failed ({e}), using lexical results")
+                self.vector_down_until = time.monotonic() + VECTOR_SEARCH_COOLDOWN
+
+        if distances is not None:
+            distances.update((id, distance) for id, _, distance in vector_hits)
+        documents = {id: document for id, document, _ in vector_hits}
+        fused = reciprocal_rank_fusion([
+            [id for id, _, _ in vector_hits],
+            [id for id, _ in lexical_hits],
+        ])[:k]
+
+        missing = [id for id, _ in fused if id not in documents]
+        if missing:
+            documents.update(self.sme.getDocuments(missing))
+        return embedding, [(id, documents[id]) for id, _ in fused if id in documents]
+
+    def rerank_ranked(self, query: str, ranked: list) -> tuple:
+        """Reorders [(id, Document)] with the cross-encoder, returns them with their scores (None on fallback)."""
+        reranker = getReranker()
+        if reranker is None or not ranked:
+            return ranked, None
+        try:
+            scores = reranker.score(query, [document.page_content for _, document in ranked], self.rerank_budget)
+        except Exception as e:
+            print(f"[{self.sme.collection_name}] rerank failed ({e}), keeping the search order")
+            scores = None
+        if scores is None:
+            return ranked, None
+        order = np.argsort(-scores, kind="stable")
+        return [ranked[i] for i in order], scores[order]
+
+    def diversify(self, ranked: list, embedding, relevance=None) -> List[Document]:
+        if (embedding is not None or relevance is not None) and ranked:
+            vectors = self.sme.getEmbeddings([id for id, _ in ranked])
+            ranked = [ranked[i] for i in mmr(embedding, [vectors[id] for id, _ in ranked], self.k, self.lambda_mult, relevance=relevance)]
+        documents = merge_overlapping([document for _, document in ranked[:self.k]])
+        return within_budget(documents, self.token_budget) if self.token_budget else documents
+
+# ================================================
+    def options(self) -> dict:
+        return {
+            "k": self.k, "hybrid": self.hybrid, "fetch_k": self.fetch_k, "diverse": self.diverse,
+            "lambda_mult": self.lambda_mult, "token_budget": self.token_budget,
+            "sections": self.sections, "route": self.route, "rerank": self.rerank,
+            "rerank_candidates": self.rerank_candidates, "rerank_budget": self.rerank_budget, "compact": self.compact,
+            "expand": self.expand, "expand_window": self.expand_window, "expand_budget": self.expand_budget,
+        }
+
+    def expand_documents(self, documents: List[Document]) -> List[Document]:
+        pages, chunks = {}, {}
+        for document in documents:
+            page, index = document.metadata.get("page_id"), document.metadata.get("chunk_index")
+            if page is not None and index is not None:
+                pages.setdefault(page, document.metadata.get("chunk_count", index + 1))
+                chunks.setdefault(page, {})[index] = document
+
+        wanted = []
+        for page, found in chunks.items():
+            if self.expand == "page":
+                wanted.extend((page, index) for index in range(pages[page]) if index not in found)
+                continue
+            for distance in range(1, self.expand_window + 1):
+                for index in found:
+                    for neighbor in (index + distance, index - distance):
+                        if 0 <= neighbor < pages[page] and neighbor not in found and (page, neighbor) not in wanted:
+                            wanted.append((page, neighbor))
+        if not wanted:
+            return documents
+        fetched = self.sme.getDocuments([chunk_id(page, index) for page, index in wanted])
+
+        used = 0
+        for page in chunks:
+            additions = [(index, fetched.get(chunk_id(p, index))) for p, index in wanted if p == page]
+            additions = [(index, document) for index, document in additions if document is not None]
+            tokens = sum(estimate_tokens(document.page_content) for _, document in additions)
+            if self.expand == "page":
+                # the whole page or nothing
+                if used + tokens <= self.expand_budget:
+                    chunks[page].update(additions)
+                    used += tokens
+                continue
+            for index, document in additions:
+                tokens = estimate_tokens(document.page_content)
+                if used + tokens <= self.expand_budget:
+                    chunks[page][index] = document
+                    used += tokens
+
+        expanded, done = [], set()
+        for document in documents:
+            page = document.metadata.get("page_id")
+            if page not in chunks:
+                expanded.append(document)
+                continue
+            if page in done:
+                continue
+            done.add(page)
+            # contiguous runs of chunks become a single passage, in page order
+            run = []
+            for index in sorted(chunks[page]):
+                if run and index != run[-1][0] + 1:
+                    expanded.append(self.__passage(run))
+                    run = []
+                run.append((index, chunks[page][index]))
+            expanded.append(self.__passage(run))
+        return expanded
+
+    @staticmethod
+    def __passage(run: list) -> Document:
+        first = run[0][1]
+        return Document(
+            page_content = join_chunks([document.page_content for _, document in run]),
+            metadata     = {**first.metadata, "chunk_indexes": ",".join(str(index) for index, _ in run)},
+        )
+
+    def search(self, query: str, embedding=None, dense: bool = True, distances: dict = None) -> tuple:
+        """Returns the documents and whether the search was complete (degraded results are not cached)."""
+        documents, complete = self.select(query, embedding, dense, distances)
+        if self.expand:
+            documents = self.expand_documents(documents)
+        return documents, complete
+
+    def select(self, query: str, embedding=None, dense: bool = True, distances: dict = None) -> tuple:
+        rank = partial(self.rank, embedding=embedding, dense=dense, distances=distances)
+        if self.rerank:
+            embedding, ranked = rank(query, max(self.rerank_candidates, self.fetch_k))
+            ranked, relevance = self.rerank_ranked(query, ranked)
+            # a rerank that timed out or failed is degraded like a missing dense search (no reranker at all is not)
+            complete = embedding is not None and (relevance is not None or not ranked or getReranker() is None)
+            if self.diverse:
+                relevance = relevance[:self.fetch_k] if relevance is not None else None
+                return self.diversify(ranked[:self.fetch_k], embedding, relevance), complete
+            return [document for _, document in ranked[:self.k]], complete
+
+        if self.diverse:
+            embedding, ranked = rank(query, self.fetch_k)
+            return self.diversify(ranked, embedding), embedding is not None
+
+        embedding, ranked = rank(query, self.k)
+        return [document for _, document in ranked], embedding is not None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if not self.cache:
+            return self.search(query)[0]
+
+        cache = getRetrievalResultCache()
+        collection, version = self.sme.collection_name, self.sme.getVersion()
+        key = cache.key(query, self.options())
+        documents = cache.get(collection, version, key)
+        if documents is None:
+            documents, complete = self.search(query)
+            if complete:
+                cache.put(collection, version, key, documents)
+        return documents
+
+# ================================================
+    async def asearch(self, query: str) -> tuple:
+        embedding, dense = None, not self.hybrid or time.monotonic() >= self.vector_down_until
+        if dense:
+            try:
+                embedding = await asyncio.wait_for(self.sme.aembedQuery(query), timeout=self.vector_timeout)
+            except asyncio.TimeoutError:
+                if not self.hybrid:
+                    raise
+                print(f"[{self.sme.collection_name}] query embedding slower than {self.vector_timeout}s, using lexical results")
+                self.vector_down_until = time.monotonic() + VECTOR_SEARCH_COOLDOWN
+                dense = False
+            except Exception as e:
+                if not self.hybrid:
+                    raise
+                print(f"[{self.sme.collection_name}] query embedding failed ({e}), using lexical results")
+                self.vector_down_until = time.monotonic() + VECTOR_SEARCH_COOLDOWN
+                dense = False
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(async_search_executor, partial(self.search, query, embedding, dense))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if not self.cache:
+            return (await self.asearch(query))[0]
+
+        loop = asyncio.get_running_loop()
+        cache = getRetrievalResultCache()
+        # reading the version can open a snapshot or stat files, never on the event loop
+        collection, version = self.sme.collection_name, await loop.run_in_executor(async_search_executor, self.sme.getVersion)
+        key = cache.key(query, self.options())
+        # a spilled entry is read from disk
+        documents = await loop.run_in_executor(async_search_executor, cache.get, collection, version, key)
+        if documents is None:
+            documents, complete = await self.asearch(query)
+            if complete:
+                await loop.run_in_executor(async_search_executor, cache.put, collection, version, key, documents)
+        return documents
@@ -0,0 +1,40 @@
+import re
+from urllib.parse import urlparse
+
+DOCS_SECTIONS = ["concepts", "tasks", "tutorials", "reference", "kubectl", "setup", "contribute"]
+
+ROUTES = [
+    ("kubectl",   re.compile(r'\bkubectl\b|(^|\s)--[a-z][\w-]*', re.I)),
+    ("reference", re.compile(r'\b(api|field|fields|flag|flags|annotation|label key|spec|schema)\b|\b[a-z]+(\.[a-z]+){2,}\b', re.I)),
+    ("tasks",     re.compile(r'\bhow (do|to|can|should)\b|\b(configure|set up|setup|install|create|debug|troubleshoot|fix|upgrade|migrate)\b', re.I)),
+    ("tutorials", re.compile(r'\b(tutorial|example|step by step|walkthrough)\b', re.I)),
+    ("concepts",  re.compile(r'\bwhat (is|are)\b|\b(explain|difference|why|concept|overview|meaning)\b', re.I)),
+]
+
+
+def docs_page_metadata(url: str, version: str) -> dict:
+    """Structured metadata of a kubernetes.io docs page: section, page path and kubernetes version."""
+    path = urlparse(url).path
+    parts = [part for part in path.split("/") if part]
+    section = "other"
+    if "docs" in parts and parts.index("docs") + 1 < len(parts):
+        section = parts[parts.index("docs") + 1]
+        if section == "reference" and "kubectl" in parts:
+            section = "kubectl"
+    return {"section": section, "path": path, "k8s_version": version}
+
+
+def route_sections(query: str):
+    """Sections that the query is likely about, None when nothing points to a specific part of the docs."""
+    sections = [section for section, pattern in ROUTES if pattern.search(query)]
+    if "kubectl" in sections and "reference" not in sections:
+        sections.append("reference")
+    return sections or None
+
+
+def section_filter(sections) -> dict:
+    if not sections:
+        return None
+    if len(sections) == 1:
+        return {"section": sections[0]}
+    return {"section": {"$in": list(sections)}}
@@ -0,0 +1,365 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from collections import Counter, defaultdict
+import numpy as np
+from langchain_core.documents import Document
+
+from embedding.bm25 import B, K1, tokenize
+from embedding.embeddings_creator import create_embeddings
+from embedding.quantized_index import CompactIndexLoader
+
+EXPORT_BATCH = 5000
+KEEP_SNAPSHOTS = 2
+VERSION_CHECK_SECONDS = 1
+NO_SECTION = -1
+
+
+def snapshots_path(collection: str) -> str:
+    return os.path.join(os.getenv('VECTORIAL_DB_PATH') or ".", "snapshots", collection)
+
+
+class BlobWriter:
+    """Appends utf8 strings to a blob file, the offsets of string i are offsets[i]:offsets[i + 1]."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(f"{path}.bin", 'wb')
+        self.offsets = [0]
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self.file.close()
+        np.save(f"{self.path}.offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+
+
+class BlobReader:
+
+    def __init__(self, path: str):
+        self.offsets = np.load(f"{path}.offsets.npy", mmap_mode="r")
+        size = os.path.getsize(f"{path}.bin")
+        # an empty file cannot be mapped
+        self.blob = np.memmap(f"{path}.bin", dtype=np.uint8, mode="r") if size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def find(self, text: str, order=None) -> int:
+        """Binary search of text among the strings sorted by order (their own order without it), None if missing."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self[int(order[middle]) if order is not None else middle] < text:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self):
+            row = int(order[low]) if order is not None else low
+            if self[row] == text:
+                return row
+        return None
+
+
+def export_lexical_index(directory: str, postings: dict, lengths: list):
+    """Writes the BM25 postings as sorted terms and flat (row, frequency) arrays, mapped by SnapshotLexicalIndex."""
+    terms = BlobWriter(os.path.join(directory, "terms"))
+    offsets, rows, frequencies = [0], [], []
+    for term in sorted(postings):
+        terms.write(term)
+        for row, frequency in postings[term]:
+            rows.append(row)
+            frequencies.append(frequency)
+        offsets.append(len(rows))
+    terms.close()
+    np.save(os.path.join(directory, "postings_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(directory, "postings_rows.npy"), np.asarray(rows, dtype=np.int32))
+    np.save(os.path.join(directory, "postings_frequencies.npy"), np.asarray(frequencies, dtype=np.int32))
+    np.save(os.path.join(directory, "lengths.npy"), np.asarray(lengths, dtype=np.int32))
+
+
+def export_snapshot(sme) -> str:
+    """
+    Writes the collection of a ChromaSme to an immutable snapshot directory and makes it the current one.
+
+    Vectors (L2 normalized float32), ids, documents, metadatas, the id lookup table and the BM25 postings
+    are stored in files that the serving processes map read-only, so all of them share the same page cache
+    instead of loading their own index.
+    """
+    version = sme.getVersion()
+    root = snapshots_path(sme.collection_name)
+    directory = os.path.join(root, version)
+    staging = f"{directory}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    collection = sme.getDb()._collection
+    count = collection.count()
+    vectors = None
+    ids = BlobWriter(os.path.join(staging, "ids"))
+    documents = BlobWriter(os.path.join(staging, "documents"))
+    metadatas = BlobWriter(os.path.join(staging, "metadatas"))
+    sections = np.full(count, NO_SECTION, dtype=np.int16)
+    section_names = []
+    stored_ids, postings, lengths = [], defaultdict(list), []
+
+    row = 0
+    for offset in range(0, count, EXPORT_BATCH):
+        result = collection.get(limit=EXPORT_BATCH, offset=offset, include=["embeddings", "documents", "metadatas"])
+        batch = np.asarray(result["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(os.path.join(staging, "vectors.npy"), mode="w+", dtype=np.float32, shape=(count, batch.shape[1]))
+        vectors[row:row + len(batch)] = batch / np.clip(np.linalg.norm(batch, axis=1, keepdims=True), 1e-12, None)
+
+        for id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"]):
+            metadata = metadata or {}
+            ids.write(id)
+            stored_ids.append(id)
+            documents.write(document or "")
+            frequencies = Counter(tokenize(document or ""))
+            lengths.append(sum(frequencies.values()))
+            for term, frequency in frequencies.items():
+                postings[term].append((row, frequency))
+            metadatas.write(json.dumps(metadata))
+            if metadata.get("section") is not None:
+                if metadata["section"] not in section_names:
+                    section_names.append(metadata["section"])
+                sections[row] = section_names.index(metadata["section"])
+            row += 1
+
+    if vectors is None:
+        np.save(os.path.join(staging, "vectors.npy"), np.zeros((0, 0), dtype=np.float32))
+    else:
+        vectors.flush()
+        del vectors
+    for writer in (ids, documents, metadatas):
+        writer.close()
+    np.save(os.path.join(staging, "sections.npy"), sections[:row])
+    np.save(os.path.join(staging, "id_order.npy"), np.asarray(sorted(range(row), key=stored_ids.__getitem__), dtype=np.int64))
+    export_lexical_index(staging, postings, lengths)
+    with open(os.path.join(staging, "meta.json"), 'w') as file:
+        json.dump({
+            "collection":        sme.collection_name,
+            "version":           version,
+            "count":             row,
+            "embedding_backend": sme.embedding_backend,
+            "sections":          section_names,
+        }, file)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+    with open(os.path.join(root, "CURRENT.tmp"), 'w') as file:
+        file.write(version)
+    os.replace(os.path.join(root, "CURRENT.tmp"), os.path.join(root, "CURRENT"))
+
+    # processes still mapping an older snapshot keep reading it until they switch, unlinked files stay valid
+    previous = sorted(
+        (name for name in os.listdir(root) if name != version and os.path.isdir(os.path.join(root, name)) and not name.endswith(".tmp")),
+        key=lambda name: os.path.getmtime(os.path.join(root, name)),
+    )
+    for name in previous[:max(0, len(previous) - (KEEP_SNAPSHOTS - 1))]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return directory
+
+
+class CollectionSnapshot:
+    """Read-only view of an exported snapshot, every array is memory-mapped."""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), 'r') as file:
+            self.meta = json.load(file)
+        self.version = self.meta["version"]
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.sections = np.load(os.path.join(directory, "sections.npy"), mmap_mode="r")
+        self.ids = BlobReader(os.path.join(directory, "ids"))
+        self.documents = BlobReader(os.path.join(directory, "documents"))
+        self.metadatas = BlobReader(os.path.join(directory, "metadatas"))
+        # rows sorted by id, an id is found by binary search instead of a per-process dict
+        self.id_order = np.load(os.path.join(directory, "id_order.npy"), mmap_mode="r")
+        self.terms = BlobReader(os.path.join(directory, "terms"))
+        self.postings_offsets = np.load(os.path.join(directory, "postings_offsets.npy"), mmap_mode="r")
+        self.postings_rows = np.load(os.path.join(directory, "postings_rows.npy"), mmap_mode="r")
+        self.postings_frequencies = np.load(os.path.join(directory, "postings_frequencies.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(directory, "lengths.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, id: str) -> int:
+        return self.ids.find(id, self.id_order)
+
+    def postings(self, term: str):
+        """The (rows, frequencies) of a term, empty arrays if no document contains it."""
+        index = self.terms.find(term)
+        if index is None:
+            return self.postings_rows[:0], self.postings_frequencies[:0]
+        start, end = self.postings_offsets[index], self.postings_offsets[index + 1]
+        return self.postings_rows[start:end], self.postings_frequencies[start:end]
+
+# ================================================
+    def mask(self, where: dict):
+        if not where:
+            return None
+        if set(where) != {"section"}:
+            raise ValueError(f"Unsupported snapshot filter: {where}")
+        wanted = where["section"]["$in"] if isinstance(where["section"], dict) else [where["section"]]
+        codes = [self.meta["sections"].index(section) for section in wanted if section in self.meta["sections"]]
+        return np.isin(self.sections, codes)
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.documents[row], metadata=json.loads(self.metadatas[row]))
+
+    def search(self, embedding, k: int = 5, where: dict = None) -> list:
+        """Cosine search returning [(row, similarity)], the vectors are read in place from the mapped file."""
+        if not len(self):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = self.vectors @ (query / max(np.linalg.norm(query), 1e-12))
+        mask = self.mask(where)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, len(scores) if mask is None else int(mask.sum()))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(row), float(scores[row])) for row in best]
+
+
+class SnapshotLexicalIndex:
+    """
+    BM25 over the postings exported in a snapshot, scores the same as a BM25Index built on the same chunks.
+    With a section only its rows are candidates and the statistics (idf, average length) are the section's.
+    """
+
+    def __init__(self, snapshot: CollectionSnapshot, section: str = None):
+        self.snapshot = snapshot
+        self.mask = snapshot.mask({"section": section}) if section else None
+        lengths = np.asarray(snapshot.lengths) if self.mask is None else np.asarray(snapshot.lengths)[self.mask]
+        self.count = len(lengths)
+        self.average_length = (float(lengths.sum()) / max(self.count, 1)) or 1
+
+    def __len__(self):
+        return self.count
+
+    def search(self, query: str, k: int = 5) -> list:
+        scores = {}
+        for term in set(tokenize(query)):
+            rows, frequencies = self.snapshot.postings(term)
+            if self.mask is not None:
+                selected = self.mask[rows]
+                rows, frequencies = rows[selected], frequencies[selected]
+            if not len(rows):
+                continue
+            idf = math.log(1 + (max(self.count, 1) - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = K1 * (1 - B + B * self.snapshot.lengths[rows] / self.average_length)
+            for row, score in zip(rows.tolist(), (idf * frequencies * (K1 + 1) / (frequencies + norm)).tolist()):
+                scores[row] = scores.get(row, 0.0) + score
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.snapshot.ids[row], score) for row, score in best]
+
+
+class SnapshotSme:
+    """
+    Serves a collection from its current snapshot with the same interface SmeRetriever uses on a ChromaSme,
+    without opening Chroma. A newer snapshot (CURRENT changed by an export) is picked up automatically.
+    """
+
+    def __init__(self, collection_name: str, embeddings=None):
+        self.collection_name = collection_name
+        self.snapshot = None
+        self.snapshot_checked_at = 0
+        self.lock = threading.Lock()
+        self.lexical_indexes = {}
+        self.lexical_version = None
+        self.lexical_lock = threading.Lock()
+        self.compact_index = CompactIndexLoader(collection_name)
+        self.getSnapshot()
+        self.embedding_backend = self.snapshot.meta["embedding_backend"]
+        self.embeddings = embeddings or create_embeddings(self.embedding_backend)
+
+# ================================================
+    @staticmethod
+    def exists(collection_name: str) -> bool:
+        return os.path.exists(os.path.join(snapshots_path(collection_name), "CURRENT"))
+
+    def getSnapshot(self) -> CollectionSnapshot:
+        with self.lock:
+            now = time.monotonic()
+            if self.snapshot is None or now - self.snapshot_checked_at >= VERSION_CHECK_SECONDS:
+                root = snapshots_path(self.collection_name)
+                with open(os.path.join(root, "CURRENT"), 'r') as file:
+                    version = file.read().strip()
+                if self.snapshot is None or self.snapshot.version != version:
+                    self.snapshot = CollectionSnapshot(os.path.join(root, version))
+                self.snapshot_checked_at = now
+            return self.snapshot
+
+    def getVersion(self) -> str:
+        return self.getSnapshot().version
+
+    def getCompactIndex(self):
+        """The quantized index built from the version of the snapshot, re-scored with its mapped vectors."""
+        return self.compact_index.get(self.getVersion())
+
+# ================================================
+    def embedQuery(self, query: str) -> [float]:
+        return self.embeddings.embed_query(query)
+
+    async def aembedQuery(self, query: str) -> [float]:
+        return await self.embeddings.aembed_query(query)
+
+    def queryByVector(self, embedding: [float], k: int = 5, where: dict = None) -> list:
+        snapshot = self.getSnapshot()
+        return [
+            (snapshot.ids[row], snapshot.document(row), 2 - 2 * similarity)
+            for row, similarity in snapshot.search(embedding, k=k, where=where)
+        ]
+
+    def getDocuments(self, ids: [str]) -> dict:
+        snapshot = self.getSnapshot()
+        rows = {id: snapshot.row(id) for id in ids}
+        return {id: snapshot.document(row) for id, row in rows.items() if row is not None}
+
+    def getEmbeddings(self, ids: [str]) -> dict:
+        snapshot = self.getSnapshot()
+        rows = {id: snapshot.row(id) for id in ids}
+        return {id: snapshot.vectors[row] for id, row in rows.items() if row is not None}
+
+    def getLexicalIndex(self, section: str = None) -> SnapshotLexicalIndex:
+        # only the section statistics are computed here, the postings are read from the mapped files
+        with self.lexical_lock:
+            snapshot = self.getSnapshot()
+            if snapshot.version != self.lexical_version:
+                self.lexical_indexes = {}
+                self.lexical_version = snapshot.version
+            if section not in self.lexical_indexes:
+                self.lexical_indexes[section] = SnapshotLexicalIndex(snapshot, section)
+            return self.lexical_indexes[section]
+
+
+def main():
+    from dotenv import load_dotenv
+    from embedding.chroma import ChromaSme
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Export a collection to a read-only memory-mapped snapshot")
+    parser.add_argument("--collection", required=True, help="Chroma collection name (e.g. k8sindex)")
+    args = parser.parse_args()
+    print(f"Snapshot written to {export_snapshot(ChromaSme(args.collection))}")
+
+
+if __name__ == "__main__":
+    main()
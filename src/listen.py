@@ -0,0 +1,15 @@
+from injectable import load_injection_container
+from agents.KubeVigiliAgent.agent import KubeVigilAgent
+from listeners.ClusterEventListener import ClusterEventAgentListener
+from dotenv import load_dotenv
+
+load_injection_container()
+load_dotenv(override=True)
+
+
+def main():
+    ClusterEventAgentListener(KubeVigilAgent).listen()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+from collections import Counter
+from injectable import inject
+
+from cluster.event_clustering import EventClusterer, kubernetes_event_to_dict
+from cluster.state_cache import ClusterStateCache
+from listeners.AgentListener import AgentListener
+
+DEBOUNCE_SECONDS = 30
+MAX_GROUP_WAIT_SECONDS = 120
+COOLDOWN_SECONDS = 600
+WORKERS = 2
+QUEUE_SIZE = 20
+
+
+class IncidentGroup:
+
+    def __init__(self, key):
+        self.key = key
+        self.first_seen = time.monotonic()
+        self.last_seen = self.first_seen
+        self.events = {}
+
+    def add(self, event: dict):
+        # a MODIFIED event carries the cumulative count: keep only the latest copy of each event
+        self.last_seen = time.monotonic()
+        self.events[event.get("metadata", {}).get("uid")] = event
+
+    def to_prompt(self) -> str:
+        namespace, kind, name = self.key
+        objects = set()
+        reasons = Counter()
+        clusterer = EventClusterer()
+        for event in self.events.values():
+            event = kubernetes_event_to_dict(event)
+            objects.add(f"{event['kind']}/{event['name']}")
+            reasons[event["reason"]] += event["count"]
+            clusterer.add(event)
+
+        reasons = ", ".join(f"{reason} x{count}" for reason, count in reasons.most_common())
+        messages = []
+        for cluster in clusterer.result()[:10]:
+            seen = f", first seen {cluster.first_seen}, last seen {cluster.last_seen}" if cluster.first_seen else ""
+            messages.append(f"- {cluster.representative['message']} (x{cluster.count}{seen})")
+        messages = "\n".join(messages)
+        return f"""
+            The following warning events have just been observed in the cluster.
+            Namespace: {namespace}
+            Resource: {kind}/{name} (involved objects: {", ".join(sorted(objects))})
+            Reasons: {reasons}
+            Messages:
+{messages}
+            Explain the problem and how to fix it.
+        """
+
+
+class ClusterEventAgentListener(AgentListener):
+    """
+    Watches the cluster events and asks the agents to analyze them.
+
+    Events are grouped per involved object (pods are grouped under their owner) and a group
+    is analyzed once it has been quiet for the debounce window, so a burst of events turns into
+    a single LLM call. A group already analyzed is not submitted again during the cooldown.
+    """
+
+    def __init__(self, agent_factory, cache: ClusterStateCache = None, workers: int = WORKERS,
+                 debounce_seconds: float = DEBOUNCE_SECONDS, cooldown_seconds: float = COOLDOWN_SECONDS,
+                 event_types=("Warning",), on_result=None):
+        super().__init__(agent_factory())
+        self.agent_factory = agent_factory
+        # the injectable singleton: other users of the cluster state share its informers
+        self.cache = cache or inject(ClusterStateCache)
+        self.workers = workers
+        self.debounce_seconds = debounce_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.event_types = event_types
+        self.on_result = on_result or self.__print_result
+
+        self.lock = threading.Lock()
+        self.groups = {}
+        self.analyzed = {}
+        self.incidents = queue.Queue(maxsize=QUEUE_SIZE)
+        self.stopped = threading.Event()
+
+# ================================================
+    def group_key(self, event: dict):
+        involved = event.get("involvedObject", {})
+        namespace = involved.get("namespace") or event.get("metadata", {}).get("namespace", "")
+        kind, name = involved.get("kind"), involved.get("name")
+
+        if kind == "Pod":
+            pod = self.cache.get("pods", namespace, name) if "pods" in self.cache.informers else None
+            owners = (pod or {}).get("metadata", {}).get("ownerReferences") or []
+            if owners:
+                kind, name = owners[0].get("kind"), owners[0].get("name")
+        return (namespace, kind, name)
+
+    def on_event(self, event_type: str, event: dict):
+        if event_type == "DELETED" or event.get("type") not in self.event_types:
+            return
+
+        key = self.group_key(event)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = IncidentGroup(key)
+            group.add(event)
+
+# ================================================
+    def __flush(self):
+        while not self.stopped.wait(1):
+            now = time.monotonic()
+            ready = []
+            with self.lock:
+                for key, group in list(self.groups.items()):
+                    if now - group.last_seen >= self.debounce_seconds or now - group.first_seen >= MAX_GROUP_WAIT_SECONDS:
+                        ready.append(self.groups.pop(key))
+
+                for key, analyzed_at in list(self.analyzed.items()):
+                    if now - analyzed_at >= self.cooldown_seconds:
+                        del self.analyzed[key]
+
+                ready = [group for group in ready if group.key not in self.analyzed]
+
+            for group in ready:
+                try:
+                    self.incidents.put_nowait(group)
+                except queue.Full:
+                    # not marked as analyzed: a new event for the group is submitted again
+                    print(f"[listener] analysis queue full, dropping incident {group.key}")
+                    continue
+                with self.lock:
+                    self.analyzed[group.key] = now
+
+    def __work(self, agent):
+        while not self.stopped.is_set():
+            try:
+                group = self.incidents.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                output = agent.invoke({"input": group.to_prompt()})
+                self.on_result(group, output["output"])
+            except Exception as e:
+                print(f"[listener] analysis of {group.key} failed: {e}")
+
+    def __print_result(self, group: IncidentGroup, output: str):
+        print(f"Incident {'/'.join(str(part) for part in group.key)}:")
+        print(output)
+        print("\n\n")
+
+# ================================================
+    def start(self):
+        self.cache.add_handler("events", self.on_event)
+        self.cache.start()
+
+        agents = [self.agent] + [self.agent_factory() for _ in range(self.workers - 1)]
+        threads = [threading.Thread(target=self.__flush, name="listener-flush", daemon=True)]
+        threads += [threading.Thread(target=self.__work, args=(agent,), name=f"listener-worker-{i}", daemon=True)
+                    for i, agent in enumerate(agents)]
+        for thread in threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.cache.stop()
+
+    def listen(self):
+        self.start()
+        try:
+            while not self.stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print('interrupted!')
+            self.stop()
@@ -11,8 +11,14 @@ langfuse_handler = CallbackHandler(
 )
 import uvicorn
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse
+from injectable import load_injection_container
 from dotenv import load_dotenv, find_dotenv
 from agents.KubeVigiliAgent.agent import KubeVigilAgent
+from embedding.embedding_cache import getQueryEmbeddingCache
+from embedding.result_cache import getRetrievalResultCache
+from utils.loop_lag import loop_lag_monitor
+from utils.warmup import warmup
 from chainlit.utils import mount_chainlit
 from langchain.schema.runnable import RunnableConfig
 import nltk
@@ -25,7 +31,7 @@ nltk.download('averaged_perceptron_tagger_eng')
 # Load env vars
 
 load_dotenv(find_dotenv())
-
+load_injection_container()
 
 
 
@@ -36,10 +42,32 @@ class ClusterVigilRequest(BaseModel):
     request_name: Optional[str] = None 
 
 
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    loop_lag_monitor.start()
+
+@app.on_event("startup")
+async def start_warmup():
+    # in the background: uvicorn starts serving /test and /ready right away
+    warmup.start()
+
 @app.get("/test")
 async def test():
     return {"status": "success", "message": "API is working"}
 
+@app.get("/ready")
+async def ready():
+    # readiness probe: the Service routes to the pod only after the warm-up
+    return JSONResponse(status_code=200 if warmup.ready else 503, content=warmup.status())
+
+@app.get("/stats")
+async def stats():
+    return {
+        "query_embedding_cache":  getQueryEmbeddingCache().stats(),
+        "retrieval_result_cache": getRetrievalResultCache().stats(),
+        "event_loop_lag":         loop_lag_monitor.stats(),
+    }
+
 @app.post("/call_clustervigil")
 async def evaluate(data: ClusterVigilRequest):
     # Estrazione dell'input dalla richiesta
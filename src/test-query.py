@@ -66,23 +66,19 @@
 # query_events('{"namespace":"","resource_name":"","resource_type":"Pod","start_time":24,"end_time":0}')
 
 
+from injectable import load_injection_container
 from tools.queryEvents_tool.tool import QueryEventsTool
 
+load_injection_container()
+
 # Initialize the search_events tool
 search_events = QueryEventsTool().getTool()
 
 # Define the namespaces
 namespaces = ['angeloazzurro-cluster', 'argocd', 'otel-demo']#, 'backstage', 'botkube', 'crossplane', 'crossplane-providers', 'default', 'falco', 'gatekeeper-system', 'gitea', 'gitlab', 'jenkins', 'k8sgpt-operator-system', 'kepler', 'kube-node-lease', 'kube-public', 'kube-system', 'kubernetes-dashboard', 'observability', 'openldap', 'otel-demo', 'podtato-kubectl', 'registry', 'test', 'test-backstage', 'test-err', 'test-gatekeeper', 'test-listener', 'test-ns1', 'test-ns2', 'traefik']
 
-# Prepare the input for the search_events tool
-inputs = [f'''{{"namespace": "{namespace}","resource_name": "","resource_type": "","event_type": "Warning","start_time": 24.0,"end_time": 0.0}}''' for namespace in namespaces]
-
-warning_events_count = {}
-for input in inputs:
-    input = input.replace('"',"'")
-    events = search_events._run(input)
-    print(events,"\n","-------------------------------------------------------------------------------------")
-    #warning_events_count[input['namespace']] = len(events)
-
-
-
+# Query all the namespaces concurrently with a single tool call
+input = f'''{{"namespaces": {namespaces},"resource_name": "","resource_type": "","event_type": "Warning","start_time": 24.0,"end_time": 0.0}}'''
+input = input.replace('"',"'")
+events = search_events.run(input)
+print(events,"\n","-------------------------------------------------------------------------------------")
@@ -0,0 +1,42 @@
+from typing import List
+from langchain.tools.retriever import create_retriever_tool
+import os
+from injectable import Autowired, autowired
+from langchain_core.prompts import PromptTemplate
+from embedding.chroma import ChromaSme
+from embedding.federated import FederatedRetriever
+from embedding.sme.kubernetes_sme import KUBERNTES_CHROMA_INDEX
+from tools.GenericTool import GenericTool
+
+# retriever options of single collections: only k8sindex is ingested with docs sections to route to
+COLLECTION_OPTIONS = {
+    KUBERNTES_CHROMA_INDEX: {"route": True, "compact": True},
+}
+
+class FederatedSmeTool(GenericTool):
+
+    @autowired
+    def __init__(self, smes: Autowired(List[ChromaSme])):
+        # every injectable ChromaSme collection (k8sindex, kubepythonindex, ...) is searched in one call,
+        # each with the retriever KubernetesSmeTool uses (MMR, rerank, snapshot) and its COLLECTION_OPTIONS
+        rerank = bool(os.getenv('RERANKER_MODEL_PATH'))
+        self.tool = create_retriever_tool(
+            retriever=FederatedRetriever(
+                retrievers=[
+                    sme.getRetriever(**{
+                        "k": 5, "hybrid": True, "diverse": True, "fetch_k": 20, "token_budget": 1500,
+                        "rerank": rerank, "rerank_candidates": 50,
+                        **COLLECTION_OPTIONS.get(sme.collection_name, {}),
+                    })
+                    for sme in smes
+                ],
+                k=6, token_budget=1800, rerank=rerank, rerank_candidates=30,
+            ),
+            name="KubernetesDocs",
+            description="""
+                This tool searches at once the kubernetes documentation and the documentation of the kubernetes python client. \
+                It does not give you information about the item present in a specific cluster, this is just documentation.
+                Each result starts with the collection it comes from.
+            """,
+            document_prompt=PromptTemplate.from_template("[{collection}] {page_content}"),
+        )
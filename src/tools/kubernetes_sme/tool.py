@@ -1,4 +1,5 @@
 from langchain.tools.retriever import create_retriever_tool
+import os
 from injectable import Autowired, autowired
 from embedding.sme.kubernetes_sme import KubernetesSme
 from tools.GenericTool import GenericTool
@@ -8,7 +9,10 @@ class KubernetesSmeTool(GenericTool):
     @autowired
     def __init__(self, sme: Autowired(KubernetesSme)):
         self.tool = create_retriever_tool(
-            retriever=sme.getDb().as_retriever(search_kwargs={'k': 5}),
+            retriever=sme.getRetriever(
+                k=5, hybrid=True, diverse=True, fetch_k=20, token_budget=1500, route=True, compact=True,
+                rerank=bool(os.getenv('RERANKER_MODEL_PATH')), rerank_candidates=50,
+            ),
             name="KubernetesSme",
             description="""
                 This tool can retrieve information on how kubernetes work in general. \
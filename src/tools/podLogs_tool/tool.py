@@ -0,0 +1,165 @@
+import re
+from injectable import inject
+from langchain_core.tools import Tool
+from requests import RequestException
+
+from cluster.api_client import KubeApiClient
+from cluster.state_cache import ClusterStateCache
+from tools.GenericTool import GenericTool
+from utils.utils import parse_tool_input, mask_volatile_tokens
+
+DEFAULT_MAX_BYTES = 16000
+DEFAULT_TAIL_LINES = 2000
+MAX_LINE_BYTES = 2000
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CONTAINER_ANNOTATION = "kubectl.kubernetes.io/default-container"
+
+SEVERITIES = {"debug": 0, "info": 1, "warning": 2, "error": 3}
+SEVERITY_PATTERNS = [
+    ("error",   re.compile(r'\b(FATAL|PANIC|CRIT(ICAL)?|ERROR|ERR|EXCEPTION|TRACEBACK)\b|Exception\b|^E\d{4} ', re.I)),
+    ("warning", re.compile(r'\b(WARN(ING)?)\b|^W\d{4} ', re.I)),
+    ("debug",   re.compile(r'\b(DEBUG|TRACE)\b|^D\d{4} ', re.I)),
+]
+
+
+def line_severity(line: str) -> str:
+    for severity, pattern in SEVERITY_PATTERNS:
+        if pattern.search(line):
+            return severity
+    return "info"
+
+
+class PodLogsTool(GenericTool):
+
+    def __init__(self, client: KubeApiClient = None, cache: ClusterStateCache = None):
+        self.client = client or KubeApiClient()
+        # the injectable singleton, filled by the informers of the ClusterEventListener:
+        # until it has synced the pods are not resolved and the API answers directly
+        self.cache = cache or inject(ClusterStateCache)
+
+        self.tool = Tool(
+            name="PodLogsTool",
+            func=self.read_logs,
+            description="""
+                This tool reads the logs of a pod container.
+                The input must be a JSON object with the fields:
+                "namespace" and "pod" (required), "container" (required if the pod has more than one container),
+                "previous" (true to read the logs of the previous, crashed, container),
+                "since_seconds", "tail_lines" (default 2000), "pattern" (regex the lines must match),
+                "min_severity" (debug, info, warning or error), "max_tokens" (size of the answer).
+                Repeated lines are collapsed and reported with their count.
+            """
+        )
+
+# ================================================
+    def filter_lines(self, lines, pattern: str = None, min_severity: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Consumes the lines one at a time: only the collapsed output (bounded by max_bytes) is kept in memory.
+        Returns the kept entries, the number of lines read and whether the budget was exhausted.
+        """
+        regex = re.compile(pattern) if pattern else None
+        threshold = SEVERITIES.get((min_severity or "debug").lower(), 0)
+
+        entries = {}
+        used_bytes = 0
+        read_lines = 0
+        for line in lines:
+            read_lines += 1
+            if regex and not regex.search(line):
+                continue
+            if threshold and SEVERITIES[line_severity(line)] < threshold:
+                continue
+
+            key = mask_volatile_tokens(line)
+            entry = entries.get(key)
+            if entry is not None:
+                entry[1] += 1
+                continue
+
+            if used_bytes + len(line) + 1 > max_bytes:
+                return list(entries.values()), read_lines, True
+            entries[key] = [line, 1]
+            used_bytes += len(line) + 1
+
+        return list(entries.values()), read_lines, False
+
+# ================================================
+    def resolve_pod(self, namespace: str, pod: str, container: str = None) -> tuple:
+        """
+        Looks the pod up in the cluster state cache: a deployment or replicaset name resolves to its newest pod
+        and the container is only required when the pod has several and no default one.
+        Returns the pod name, the container and an error message, or (pod, container, None) when the cache has not synced.
+        """
+        if not self.cache.has_synced():
+            return pod, container, None
+
+        obj = self.cache.get("pods", namespace, pod)
+        if obj is None:
+            candidates = [candidate for candidate in self.cache.list("pods", namespace=namespace)
+                          if candidate["metadata"]["name"].startswith(f"{pod}-")]
+            if not candidates:
+                return pod, container, f"Pod {namespace}/{pod} not found."
+            # running pods first, then the most recently started
+            obj = max(candidates, key=lambda candidate: (
+                candidate.get("status", {}).get("phase") == "Running",
+                candidate.get("status", {}).get("startTime") or "",
+            ))
+            pod = obj["metadata"]["name"]
+
+        if not container:
+            containers = [c["name"] for c in obj.get("spec", {}).get("containers", [])]
+            annotations = obj["metadata"].get("annotations") or {}
+            if annotations.get(DEFAULT_CONTAINER_ANNOTATION) in containers:
+                container = annotations[DEFAULT_CONTAINER_ANNOTATION]
+            elif len(containers) > 1:
+                return pod, container, f"Pod {namespace}/{pod} has several containers, set \"container\" to one of: {', '.join(containers)}."
+        return pod, container, None
+
+# ================================================
+    def read_logs(self, input) -> str:
+        input_json = parse_tool_input(input)
+        namespace = input_json.get("namespace")
+        pod = input_json.get("pod")
+        if not namespace or not pod:
+            return "Both namespace and pod are required."
+
+        pod, container, error = self.resolve_pod(namespace, pod, input_json.get("container"))
+        if error:
+            return error
+
+        params = {"tailLines": int(input_json.get("tail_lines") or DEFAULT_TAIL_LINES)}
+        if container:
+            params["container"] = container
+        if input_json.get("since_seconds"):
+            params["sinceSeconds"] = int(input_json["since_seconds"])
+        previous = input_json.get("previous")
+        if previous is True or str(previous).strip().lower() in ("true", "1", "yes"):
+            params["previous"] = "true"
+
+        max_bytes = DEFAULT_MAX_BYTES
+        if input_json.get("max_tokens"):
+            max_bytes = min(max_bytes, int(input_json["max_tokens"]) * CHARS_PER_TOKEN)
+
+        lines = self.client.stream(f"/api/v1/namespaces/{namespace}/pods/{pod}/log", params=params,
+                                   timeout=(10, 60), max_line_bytes=MAX_LINE_BYTES)
+        try:
+            entries, read_lines, truncated = self.filter_lines(
+                lines,
+                pattern      = input_json.get("pattern"),
+                min_severity = input_json.get("min_severity"),
+                max_bytes    = max_bytes,
+            )
+        except RequestException as e:
+            return f"Unable to read the logs of {namespace}/{pod}: {e.response.text if e.response is not None else e}"
+        finally:
+            # stops the download as soon as the budget is reached
+            lines.close()
+
+        if not entries:
+            return f"No matching log lines in the last {read_lines} lines of {namespace}/{pod}."
+
+        output = [f"{line} (repeated x{count})" if count > 1 else line for line, count in entries]
+        if truncated:
+            output.append(f"[output truncated after {read_lines} lines: budget of {max_bytes} bytes reached, narrow the query]")
+        return "\n".join(output)
@@ -0,0 +1,226 @@
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from injectable import inject
+from langchain_core.tools import Tool
+from requests.adapters import HTTPAdapter
+import requests
+
+from cluster.event_clustering import EventClusterer
+from cluster.state_cache import ClusterStateCache
+from tools.GenericTool import GenericTool
+from utils.utils import parse_tool_input
+
+LOKI_URL = os.getenv('LOKI_URL', "https://loki.liquid-reply.net/loki/api/v1/query_range")
+FAN_OUT_CONCURRENCY = int(os.getenv('EVENTS_FAN_OUT_CONCURRENCY', 8))
+MAX_CLUSTERS_IN_RESPONSE = 30
+TOP_REASONS = 3
+REQUEST_TIMEOUT = 30
+
+BASE_QUERY = '{app="kubernetes-event-exporter"} |= `` | json | line_format `[{{.metadata_namespace}}] [{{.involvedObject_kind}}] "{{.involvedObject_name}}" [{{.type}}] [{{.reason}}] {{.message}}`'
+EVENT_LINE = re.compile(r'^\[(?P<namespace>[^\]]*)\] \[(?P<kind>[^\]]*)\] "(?P<name>[^"]*)" \[(?P<type>[^\]]*)\] \[(?P<reason>[^\]]*)\] (?P<message>.*)$', re.S)
+
+
+def format_timestamp(nanoseconds: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(nanoseconds / 1000000000))
+
+
+def event_line(event: dict) -> str:
+    """Formats a kubernetes event like the line_format of BASE_QUERY."""
+    involved = event.get("involvedObject", {})
+    return (f'[{event.get("metadata", {}).get("namespace", "")}] [{involved.get("kind", "")}] "{involved.get("name", "")}" '
+            f'[{event.get("type", "")}] [{event.get("reason", "")}] {event.get("message", "")}')
+
+
+def event_timestamp(event: dict) -> int:
+    """Nanoseconds of the last occurrence of a kubernetes event, 0 when it has no timestamp."""
+    value = event.get("lastTimestamp") or event.get("eventTime") or event.get("metadata", {}).get("creationTimestamp")
+    if not value:
+        return 0
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000000000)
+
+
+class QueryEventsTool(GenericTool):
+
+    def __init__(self, loki_url: str = LOKI_URL, concurrency: int = FAN_OUT_CONCURRENCY, cache: ClusterStateCache = None):
+        self.loki_url = loki_url
+        self.concurrency = max(1, concurrency)
+        # the injectable singleton, filled by the informers of the ClusterEventListener
+        self.cache = cache or inject(ClusterStateCache)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.tool = Tool(
+            name="QueryEventsTool",
+            func=self.query_events,
+            description="""
+                This tool retrieves the kubernetes events of the cluster.
+                The input must be a JSON object with the following optional fields:
+                "namespace" (regex), "namespaces" (list of namespaces or namespace regex to query together),
+                "resource_name" (regex), "resource_type" (e.g. Pod, Deployment), "event_type" (Normal or Warning),
+                "start_time" (hours ago, default 24), "end_time" (hours ago, default 0).
+                Use "namespaces" to check several namespaces in a single call: the answer contains
+                the per-namespace counts, the top reasons and the events grouped by similarity.
+            """
+        )
+
+# ================================================
+    def __build_query(self, namespace, resource_name, resource_type, event_type) -> str:
+        query = BASE_QUERY
+        if namespace:
+            query += f' | metadata_namespace =~ `{namespace}`'
+        if resource_name:
+            query += f' | involvedObject_name =~ `{resource_name}`'
+        if resource_type:
+            query += f' | involvedObject_kind =~ `{resource_type}`'
+        if event_type:
+            query += f' | type =~ `{event_type}`'
+        return query
+
+    def __fetch(self, query: str, start: int, end: int) -> list:
+        params = {"query": query, "start": str(start), "end": str(end)}
+        response = self.session.get(self.loki_url, params=params, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+
+        values = []
+        for stream in response.json()["data"]["result"]:
+            values.extend(stream["values"])
+        return values
+
+    def cached_events(self, namespace, resource_name, resource_type, event_type, start: int, end: int):
+        """
+        The events of the time range still stored in the cluster (kept about one hour by the API server),
+        read from the cluster state cache and filtered like the Loki query. None when the cache has not synced.
+        """
+        if not self.cache.has_synced():
+            return None
+        # the regex label filters of LogQL are fully anchored
+        filters = [(re.compile(regex), field) for regex, field in (
+            (namespace, lambda e: e.get("metadata", {}).get("namespace", "")),
+            (resource_name, lambda e: e.get("involvedObject", {}).get("name", "")),
+            (resource_type, lambda e: e.get("involvedObject", {}).get("kind", "")),
+            (event_type, lambda e: e.get("type", "")),
+        ) if regex]
+
+        values = []
+        for event in self.cache.list("events"):
+            if all(regex.fullmatch(field(event)) for regex, field in filters):
+                timestamp = event_timestamp(event)
+                if start <= timestamp <= end:
+                    values.append((str(timestamp), event_line(event)))
+        return values
+
+# ================================================
+    def fan_out(self, namespaces: [str], resource_name=None, resource_type=None, event_type=None,
+                start_time: float = 24, end_time: float = 0) -> dict:
+        """
+        Runs one Loki query per namespace (or namespace regex) concurrently and merges the results.
+        Events exported several times (same line) are counted once, keeping the latest timestamp.
+        An event returned by more than one query (overlapping namespace regexes) is only counted once.
+        When a query fails, the events still stored in the cluster are used for its namespace.
+        """
+        if not namespaces:
+            return {"events": [], "errors": []}
+        end = int((time.time() - end_time * 60 * 60) * 1000000000)
+        start = end - int((start_time - end_time) * 60 * 60 * 1000000000)
+
+        queries = [self.__build_query(namespace, resource_name, resource_type, event_type) for namespace in namespaces]
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(queries))) as executor:
+            futures = [executor.submit(self.__fetch, query, start, end) for query in queries]
+
+        events = {}
+        seen = set()
+        errors = []
+        for namespace, future in zip(namespaces, futures):
+            try:
+                values = future.result()
+            except Exception as e:
+                values = self.cached_events(namespace, resource_name, resource_type, event_type, start, end)
+                if values is None:
+                    errors.append(f"{namespace}: {e}")
+                    continue
+                errors.append(f"{namespace}: {e} (showing only the recent events still stored in the cluster)")
+            for timestamp, line in values:
+                if (timestamp, line) in seen:
+                    continue
+                seen.add((timestamp, line))
+                known = events.get(line)
+                if known is None:
+                    events[line] = {"line": line, "timestamp": int(timestamp), "occurrences": 1}
+                else:
+                    known["timestamp"] = max(known["timestamp"], int(timestamp))
+                    known["occurrences"] += 1
+
+        return {"events": sorted(events.values(), key=lambda e: e["timestamp"], reverse=True), "errors": errors}
+
+# ================================================
+    def summarize(self, result: dict, max_clusters: int = MAX_CLUSTERS_IN_RESPONSE) -> str:
+        per_namespace = {}
+        clusterer = EventClusterer()
+        for event in result["events"]:
+            match = EVENT_LINE.match(event["line"])
+            namespace = match["namespace"] if match else "unknown"
+            stats = per_namespace.setdefault(namespace, {"count": 0, "types": Counter(), "reasons": Counter()})
+            stats["count"] += 1
+            if match:
+                stats["types"][match["type"]] += 1
+                stats["reasons"][match["reason"]] += 1
+
+            fields = match.groupdict() if match else {"namespace": namespace, "message": event["line"]}
+            clusterer.add({**fields, "line": event["line"], "timestamp": event["timestamp"], "count": event["occurrences"]})
+
+        if not per_namespace and not result["errors"]:
+            return "No events found."
+
+        lines = [f"Found {len(result['events'])} unique events in {len(per_namespace)} namespaces."]
+        for namespace, stats in sorted(per_namespace.items(), key=lambda item: item[1]["count"], reverse=True):
+            types = ", ".join(f"{name}: {count}" for name, count in stats["types"].most_common())
+            reasons = ", ".join(f"{name} x{count}" for name, count in stats["reasons"].most_common(TOP_REASONS))
+            lines.append(f"- {namespace}: {stats['count']} events ({types}); top reasons: {reasons}")
+
+        clusters = clusterer.result()
+        if clusters:
+            lines.append(f"Similar events grouped together ({len(clusters)} groups, max {max_clusters} shown):")
+            for cluster in clusters[:max_clusters]:
+                objects = ", ".join(cluster.objects)
+                namespaces = ", ".join(sorted(str(namespace) for namespace in cluster.namespaces))
+                lines.append(f"{cluster.representative['line']} (x{cluster.count}; namespaces: {namespaces}; {objects}; "
+                             f"first seen {format_timestamp(cluster.first_seen)}, last seen {format_timestamp(cluster.last_seen)})")
+
+        for error in result["errors"]:
+            lines.append(f"Query failed for {error}")
+        return "\n".join(lines)
+
+# ================================================
+    def query_events(self, input) -> str:
+        input_json = parse_tool_input(input)
+
+        # an explicit 0 is a valid value, only a missing (null or empty) field gets the default
+        start_time = float(24 if input_json.get("start_time") in (None, "") else input_json["start_time"])
+        end_time = float(0 if input_json.get("end_time") in (None, "") else input_json["end_time"])
+        if start_time < 0 or end_time < 0:
+            raise ValueError("start_time and end_time must be positive numbers.")
+        if start_time < end_time:
+            raise ValueError("You must enter start_time > end_time.")
+
+        namespaces = input_json.get("namespaces") or [input_json.get("namespace") or ""]
+        if isinstance(namespaces, str):
+            namespaces = [namespaces]
+        # keep the order but never query the same namespace twice
+        namespaces = list(dict.fromkeys(namespaces))
+
+        result = self.fan_out(
+            namespaces,
+            resource_name = input_json.get("resource_name"),
+            resource_type = input_json.get("resource_type"),
+            event_type    = input_json.get("event_type"),
+            start_time    = start_time,
+            end_time      = end_time,
+        )
+        return self.summarize(result)
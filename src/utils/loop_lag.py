@@ -0,0 +1,52 @@
+import asyncio
+import time
+from collections import deque
+import numpy as np
+
+LAG_INTERVAL = 0.1
+LAG_SAMPLES = 3000
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping for interval seconds:
+    any blocking call running on the loop shows up as lag for every other request.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL, samples: int = LAG_SAMPLES):
+        self.interval = interval
+        self.samples = deque(maxlen=samples)
+        self.max_lag = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def __run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def stats(self) -> dict:
+        samples = np.array(self.samples) * 1000
+        if not len(samples):
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "p50_ms":  float(np.percentile(samples, 50)),
+            "p95_ms":  float(np.percentile(samples, 95)),
+            "p99_ms":  float(np.percentile(samples, 99)),
+            "max_ms":  self.max_lag * 1000,
+        }
+
+
+loop_lag_monitor = EventLoopLagMonitor()
@@ -1,7 +1,43 @@
+import ast
+import json
+import re
+
+# kubernetes generates the suffixes of pods and replicasets from an alphabet without vowels
+HASH_CHAR = r'[bcdfghjklmnpqrstvwxz2456789]'
+HAS_DIGIT = r'(?=[bcdfghjklmnpqrstvwxz]*[2456789])'
+
+VOLATILE_TOKENS = [
+    # "<replicaset hash>-<pod suffix>", or a single suffix with at least one digit: words like "https" or "crypt" are kept
+    (re.compile(rf'-{HASH_CHAR}{{8,10}}-{HASH_CHAR}{{5}}(?![a-z0-9])|-{HAS_DIGIT}{HASH_CHAR}{{8,10}}(?![a-z0-9])|-{HAS_DIGIT}{HASH_CHAR}{{5}}(?![a-z0-9])'), "-<HASH>"),
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?'), "<TS>"),
+    (re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.I), "<UUID>"),
+    (re.compile(r'\b\d{1,3}(\.\d{1,3}){3}(:\d+)?\b'), "<IP>"),
+    (re.compile(r'\b0x[0-9a-f]+\b|\b[0-9a-f]{12,}\b', re.I), "<HEX>"),
+    (re.compile(r'\d+'), "<N>"),
+]
+
+
 def read_text_file(file_name):
     try:
         with open(file_name, 'r') as file:
             data = file.read()
         return data
     except FileNotFoundError:
-        return "File not found."
\ No newline at end of file
+        return "File not found."
+
+
+def parse_tool_input(input) -> dict:
+    if isinstance(input, dict):
+        return input
+    try:
+        return json.loads(input)
+    except json.JSONDecodeError:
+        # the agent often sends python-like dicts with single quotes
+        return ast.literal_eval(input)
+
+
+def mask_volatile_tokens(text: str) -> str:
+    """Replaces timestamps, ids, addresses and numbers so that lines differing only by them compare equal."""
+    for pattern, placeholder in VOLATILE_TOKENS:
+        text = pattern.sub(placeholder, text)
+    return text
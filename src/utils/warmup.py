@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+from injectable import inject
+
+from embedding.reranker import getReranker
+from embedding.sme.kubepython_sme import KubePythonSme
+from embedding.sme.kubernetes_sme import KubernetesSme
+from llm.llm_creator import create_new_llm
+from tools.federated_sme.tool import FederatedSmeTool
+
+WARMUP_QUERIES = [
+    "pod in CrashLoopBackOff after a deployment",
+    "how to configure a readiness probe",
+    "kubectl get pods in a namespace",
+]
+WARMUP_STEP_TIMEOUT = float(os.getenv('WARMUP_STEP_TIMEOUT', 60))
+
+
+class Warmup:
+    """
+    Pays at startup what the first queries would otherwise pay: opening the collections (Chroma or the shared
+    snapshot, BM25 and compact indexes), loading the local models and opening the connections to the embedding
+    and chat endpoints. The pod is reported ready only once it is done; a failing step is recorded but
+    does not keep the pod out of the Service forever.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.started_at = None
+        self.seconds = None
+        self.steps = {}
+        self.task = None
+
+    async def __step(self, name: str, function, *args):
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(function):
+                await asyncio.wait_for(function(*args), WARMUP_STEP_TIMEOUT)
+            else:
+                await asyncio.wait_for(asyncio.to_thread(function, *args), WARMUP_STEP_TIMEOUT)
+            self.steps[name] = {"seconds": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e!r}")
+            self.steps[name] = {"seconds": round(time.perf_counter() - start, 3), "error": repr(e)}
+
+# ================================================
+    def load_collections(self):
+        for sme in (inject(KubernetesSme), inject(KubePythonSme)):
+            # through the retriever the tools get: with SME_SNAPSHOTS=true the snapshot, Chroma is not opened
+            retriever = sme.getRetriever(cache=False)
+            retriever.sme.getVersion()
+            retriever.sme.getLexicalIndex()
+            retriever.sme.getCompactIndex()
+            # the first query loads the vectors (HNSW segments or mapped snapshot) and the BM25 index
+            retriever.invoke(WARMUP_QUERIES[0])
+
+    async def run_queries(self):
+        tool = FederatedSmeTool().getTool()
+        for query in WARMUP_QUERIES:
+            await tool.ainvoke(query)
+
+    async def prime_llm(self):
+        await create_new_llm().ainvoke("ping", max_tokens=1)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        self.started_at = time.time()
+        start = time.perf_counter()
+        await self.__step("collections", self.load_collections)
+        await self.__step("reranker", getReranker)
+        await self.__step("queries", self.run_queries)
+        if os.getenv('WARMUP_LLM', "true").lower() == "true":
+            await self.__step("llm", self.prime_llm)
+        self.seconds = round(time.perf_counter() - start, 3)
+        self.ready = True
+        print(f"Warm-up done in {self.seconds}s")
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "seconds": self.seconds, "steps": self.steps}
+
+
+warmup = Warmup()
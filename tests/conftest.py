@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules under src/ are imported the way the app imports them (cd src/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
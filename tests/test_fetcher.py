@@ -0,0 +1,104 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from embedding.fetcher import PageFetcher
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class DocsServer:
+    """Local http.server serving docs pages: validators, a 429 with Retry-After, request times per path."""
+
+    def __init__(self, throttled: int = 0, retry_after: str = "0.3"):
+        self.throttled = throttled
+        self.retry_after = retry_after
+        self.requests = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests.append((time.monotonic(), self.path, self.headers.get("If-None-Match")))
+                    throttle = self.path == "/throttled" and server.throttled > 0
+                    if throttle:
+                        server.throttled -= 1
+                if throttle:
+                    self.send_response(429)
+                    self.send_header("Retry-After", server.retry_after)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == ETAG:
+                    self.send_response(304)
+                    self.send_header("ETag", ETAG)
+                    self.end_headers()
+                    return
+                body = f"<html><body>{self.path}</body></html>".encode()
+                self.send_response(200)
+                self.send_header("ETag", ETAG)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_conditional_request_returns_304_without_body():
+    server = DocsServer()
+    try:
+        fetcher = PageFetcher(concurrency=2, rate_per_host=0)
+        first = fetcher.fetch(f"{server.url}/page")
+        assert first.ok and first.status == 200 and "/page" in first.text
+        assert (first.etag, first.last_modified) == (ETAG, LAST_MODIFIED)
+
+        again = fetcher.fetch(f"{server.url}/page", first.etag, first.last_modified)
+        assert again.ok and again.not_modified and again.text is None
+        # the validators are kept for the next run even when the 304 does not repeat them
+        assert (again.etag, again.last_modified) == (ETAG, LAST_MODIFIED)
+        assert server.requests[-1][2] == ETAG
+    finally:
+        server.close()
+
+
+def test_429_is_retried_after_retry_after():
+    server = DocsServer(throttled=1, retry_after="0.3")
+    try:
+        start = time.monotonic()
+        result = PageFetcher(concurrency=2, rate_per_host=0, retries=2).fetch(f"{server.url}/throttled")
+        assert result.ok and result.status == 200
+        times = [at for at, path, _ in server.requests if path == "/throttled"]
+        assert len(times) == 2
+        assert times[1] - times[0] >= 0.3
+        assert time.monotonic() - start >= 0.3
+    finally:
+        server.close()
+
+
+def test_requests_to_one_host_are_spaced_by_the_rate_limit():
+    server = DocsServer()
+    try:
+        fetcher = PageFetcher(concurrency=8, rate_per_host=10)
+        results = list(fetcher.fetch_all([f"{server.url}/page{i}" for i in range(6)]))
+        assert sorted(result.url for result in results) == sorted(f"{server.url}/page{i}" for i in range(6))
+        assert all(result.ok for result in results)
+
+        # 8 threads, yet at most 10 requests per second reach the host
+        times = sorted(at for at, _, _ in server.requests)
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        assert min(gaps) >= 0.08
+        assert times[-1] - times[0] >= 0.45
+    finally:
+        server.close()
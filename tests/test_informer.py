@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cluster import state_cache
+from cluster.api_client import KubeApiClient
+from cluster.state_cache import Informer
+
+
+def pod(name: str, resource_version: str, labels: dict = None) -> dict:
+    return {"metadata": {"namespace": "default", "name": name, "resourceVersion": resource_version, "labels": labels or {}}}
+
+
+class FakeApiServer:
+    """
+    Serves /api/v1/pods like the API server: paged lists and watch streams scripted per call.
+    lists[i] is the list served by the i-th LIST (its pages), watches[i] the events of the i-th WATCH
+    (a string is sent as a raw line).
+    """
+
+    def __init__(self, lists: list, watches: list):
+        self.lists = lists
+        self.watches = watches
+        self.requests = []
+        self.list_calls = 0
+        self.watch_calls = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                fake.requests.append({**query, "at": time.monotonic()})
+                if query.get("watch") == "1":
+                    events = fake.watches[fake.watch_calls] if fake.watch_calls < len(fake.watches) else None
+                    fake.watch_calls += 1
+                    if events is None:
+                        # nothing more scripted: an idle watch that ends quickly
+                        time.sleep(0.05)
+                        events = []
+                    body = "".join((event if isinstance(event, str) else json.dumps(event)) + "\n" for event in events).encode()
+                else:
+                    pages = fake.lists[min(fake.list_calls, len(fake.lists) - 1)]
+                    page = int(query.get("continue", 0))
+                    if page == len(pages) - 1:
+                        fake.list_calls += 1
+                    body = json.dumps(pages[page]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_list_watch_bookmark_and_relist_on_410():
+    server = FakeApiServer(
+        lists=[
+            # two pages joined by the continue token
+            [
+                {"items": [pod("a", "1", {"app": "web"})], "metadata": {"continue": "1"}},
+                {"items": [pod("b", "2", {"app": "db"})], "metadata": {"resourceVersion": "10"}},
+            ],
+            # after the 410: the cluster changed while the watch was down
+            [{"items": [pod("b", "2", {"app": "db"}), pod("d", "18")], "metadata": {"resourceVersion": "20"}}],
+        ],
+        watches=[
+            [
+                {"type": "ADDED", "object": pod("c", "11", {"app": "web"})},
+                {"type": "DELETED", "object": pod("a", "12")},
+                {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "15"}}},
+            ],
+            [{"type": "ERROR", "object": {"kind": "Status", "code": 410, "reason": "Expired"}}],
+            [{"type": "MODIFIED", "object": pod("d", "21", {"app": "web"})}],
+        ],
+    )
+    informer = Informer(KubeApiClient(base_url=server.url, token="test", verify=False), "pods", "/api/v1/pods")
+    deltas = []
+    informer.add_handler(lambda event_type, obj: deltas.append((event_type, obj["metadata"]["name"])))
+    try:
+        informer.start()
+        assert informer.synced.wait(5)
+        assert wait_until(lambda: informer.get("default", "d") is not None and informer.get("default", "d")["metadata"]["labels"])
+
+        # the watches resume from the list, then from the bookmark, then from the relist
+        watched = [request["resourceVersion"] for request in server.requests if request.get("watch") == "1"]
+        assert watched[:3] == ["10", "15", "20"]
+        assert server.list_calls == 2
+        # bookmarks move the resourceVersion but are not deltas, the relist is not replayed as deltas
+        assert deltas == [("ADDED", "c"), ("DELETED", "a"), ("MODIFIED", "d")]
+
+        # the relist replaced the state: c was only seen by the expired watch
+        assert informer.get("default", "c") is None
+        assert sorted(item["metadata"]["name"] for item in informer.list(namespace="default")) == ["b", "d"]
+        assert [item["metadata"]["name"] for item in informer.list(label_selector="app=web")] == ["d"]
+    finally:
+        informer.stop()
+        informer.thread.join(5)
+        server.close()
+
+
+def test_failing_watch_backs_off(monkeypatch):
+    monkeypatch.setattr(state_cache, "MAX_BACKOFF_SECONDS", 1)
+    server = FakeApiServer(
+        lists=[[{"items": [pod("a", "1")], "metadata": {"resourceVersion": "10"}}]],
+        watches=[
+            [{"type": "ERROR", "object": {"kind": "Status", "code": 500, "reason": "InternalError"}}],
+            ['{"type": "ADDED", "object": {"metadata": '],
+            [{"type": "ADDED", "object": pod("b", "11")}],
+        ],
+    )
+    informer = Informer(KubeApiClient(base_url=server.url, token="test", verify=False), "pods", "/api/v1/pods")
+    try:
+        informer.start()
+        # neither the error status nor the truncated line stop the informer
+        assert wait_until(lambda: informer.get("default", "b") is not None)
+        watches = [request for request in server.requests if request.get("watch") == "1"]
+        # each failure waits before the next watch instead of reconnecting at once
+        assert watches[1]["at"] - watches[0]["at"] >= 0.9
+        assert watches[2]["at"] - watches[1]["at"] >= 0.9
+        assert [request["resourceVersion"] for request in watches[:3]] == ["10", "10", "10"]
+        assert server.list_calls == 1
+    finally:
+        informer.stop()
+        informer.thread.join(5)
+        server.close()
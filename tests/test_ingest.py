@@ -0,0 +1,184 @@
+import functools
+import time
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding import chroma
+from embedding.chunks import chunk_hash, shared_chunk_id
+from embedding.embedding_scheduler import EmbeddingScheduler
+from embedding.manifest import IngestionCheckpoint, IngestionManifest
+
+BANNER = "FEATURE STATE: Kubernetes v1.30 [stable] this banner is repeated by many pages of the docs"
+
+
+def text(name: str) -> str:
+    # one chunk per paragraph: with names of 4 to 8 letters two of them never fit in CHUNK_SIZE
+    return f"{name}: " + " ".join([name] * 10)
+
+
+def page(url: str, *paragraphs: str) -> Document:
+    return Document(page_content="\n\n".join(paragraphs), metadata={"source": url})
+
+
+class FakeCollection:
+    """The part of the Chroma collection API used by the ingestion, in memory. update merges the metadata like Chroma."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents")):
+        ids = [
+            id for id in (self.rows if ids is None else ids)
+            if id in self.rows and all(self.rows[id]["metadatas"].get(key) == value for key, value in (where or {}).items())
+        ]
+        result = {"ids": ids}
+        for field in include:
+            result[field] = [self.rows[id][field] for id in ids]
+        return result
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        for id, embedding, metadata, document in zip(ids, embeddings, metadatas, documents):
+            self.rows[id] = {"embeddings": embedding, "metadatas": dict(metadata), "documents": document}
+
+    def update(self, ids, metadatas):
+        for id, metadata in zip(ids, metadatas):
+            self.rows[id]["metadatas"].update(metadata)
+
+    def delete(self, ids):
+        for id in ids:
+            self.rows.pop(id, None)
+
+    def count(self) -> int:
+        return len(self.rows)
+
+
+class FakeChroma:
+
+    def __init__(self):
+        self._collection = FakeCollection()
+
+    def persist(self):
+        pass
+
+
+class FakeEmbeddings(Embeddings):
+    """Records the embedded texts, before_embed(texts) can fail a batch."""
+
+    def __init__(self):
+        self.embedded = []
+        self.before_embed = None
+
+    def embed_documents(self, texts):
+        if self.before_embed:
+            self.before_embed(texts)
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+@pytest.fixture
+def sme(monkeypatch, tmp_path):
+    monkeypatch.setenv("VECTORIAL_DB_PATH", str(tmp_path))
+    monkeypatch.setattr(chroma, "CHUNK_SIZE", 100)
+    monkeypatch.setattr(chroma, "CHUNK_OVERLAP", 0)
+    # pages and chunks go through the pipeline in order, one at a time
+    monkeypatch.setattr(chroma, "INGEST_SPLIT_WORKERS", 1)
+    monkeypatch.setattr(chroma, "EMBED_BATCH_SIZE", 1)
+    monkeypatch.setattr(chroma, "EmbeddingScheduler", functools.partial(EmbeddingScheduler, max_concurrency=1))
+    monkeypatch.setattr(chroma, "create_embeddings", lambda backend: FakeEmbeddings())
+    sme = chroma.ChromaSme("testindex")
+    sme.chroma = FakeChroma()
+    return sme
+
+
+def ingest(sme, pages: list, **kwargs) -> list:
+    """Runs a full ingestion (the deduplicator is loaded from the collection), returns the texts it embedded."""
+    sme.embeddings.embedded.clear()
+    sme._ChromaSme__ingest(pages, **kwargs)
+    return list(sme.embeddings.embedded)
+
+
+def rows(sme) -> dict:
+    return sme.db._collection.rows
+
+
+def documents(sme, source: str) -> list:
+    return sorted(row["documents"] for row in rows(sme).values() if row["metadatas"]["source"] == source)
+
+
+# ================================================
+def test_shared_chunk_keeps_its_vector_when_moved_and_reingested(sme):
+    assert ingest(sme, [page("A", text("alpha"), BANNER), page("B", text("bravo"), BANNER)]) == [text("alpha"), BANNER, text("bravo")]
+
+    # A drops the banner: it moves to a content id listing B, its vector is copied, not embedded again
+    shared = shared_chunk_id(chunk_hash(BANNER))
+    vector = next(row["embeddings"] for row in rows(sme).values() if row["documents"] == BANNER)
+    assert ingest(sme, [page("A", text("alpha"), text("apple")), page("B", text("bravo"), BANNER)]) == [text("apple")]
+    assert rows(sme)[shared]["metadatas"]["source"] == "B"
+    assert rows(sme)[shared]["embeddings"] == vector
+
+    # an unchanged full run keeps the shared chunk: nothing is embedded or deleted
+    before = dict(rows(sme))
+    assert ingest(sme, [page("A", text("alpha"), text("apple")), page("B", text("bravo"), BANNER)]) == []
+    assert set(rows(sme)) == set(before)
+    assert documents(sme, "B") == sorted([text("bravo"), BANNER])
+
+    # C gets the banner while B drops it: C keeps the stored chunk, or stores it again, never loses it
+    ingest(sme, [page("B", text("bravo")), page("C", text("charlie"), BANNER)])
+    assert documents(sme, "B") == [text("bravo")]
+    assert documents(sme, "C") == sorted([text("charlie"), BANNER])
+
+    # the last page listing it drops it: the shared chunk is deleted
+    assert ingest(sme, [page("C", text("charlie"))]) == []
+    assert [row for row in rows(sme).values() if row["documents"] == BANNER] == []
+
+
+def test_resume_after_a_crash_in_the_middle_of_a_page(sme, tmp_path):
+    pages = [page("P1", text("xray"), text("xenon")), page("P2", text("yacht"), text("yodel"), text("yeast")), page("P3", text("zulu"))]
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite"))
+
+    def crash(texts):
+        # once P1 and the first two chunks of P2 are stored
+        if text("yeast") in texts:
+            deadline = time.monotonic() + 5
+            while sme.db._collection.count() < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            raise RuntimeError("embedding service down")
+
+    sme.embeddings.before_embed = crash
+    checkpoint = IngestionCheckpoint("testindex", manifest=manifest, every=1)
+    with pytest.raises(RuntimeError):
+        ingest(sme, pages, checkpoint=checkpoint)
+    assert "P1" in checkpoint.done and "P2" not in checkpoint.done
+    assert documents(sme, "P2") == sorted([text("yacht"), text("yodel")])
+
+    # the resumed run skips P1 and only embeds what P2 and P3 miss
+    sme.embeddings.before_embed = None
+    checkpoint = IngestionCheckpoint("testindex", resume=True, manifest=manifest, every=1)
+    embedded = ingest(sme, [page for page in pages if page.metadata["source"] not in checkpoint.done], checkpoint=checkpoint)
+    checkpoint.finish()
+    assert embedded == [text("yeast"), text("zulu")]
+    assert documents(sme, "P2") == sorted([text("yacht"), text("yodel"), text("yeast")])
+    assert sme.db._collection.count() == 6
+
+
+def test_shrunk_page_loses_its_old_chunks(sme):
+    ingest(sme, [page("P", text("xray"), text("xenon"), text("xerox"))])
+
+    assert ingest(sme, [page("P", text("xray"))]) == []
+    assert documents(sme, "P") == [text("xray")]
+    assert sme.db._collection.count() == 1
+
+
+def test_changed_chunk_is_embedded_again_under_its_id(sme):
+    ingest(sme, [page("P", text("xray"), text("xenon"))])
+    ids = sorted(rows(sme))
+
+    assert ingest(sme, [page("P", text("xray"), text("xerus"))]) == [text("xerus")]
+    assert sorted(rows(sme)) == ids
+    assert rows(sme)[ids[1]]["documents"] == text("xerus")
+    assert rows(sme)[ids[1]]["metadatas"]["content_hash"] == chunk_hash(text("xerus"))